@@ -0,0 +1,111 @@
+import time
+import logging
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, default_collate
+from crowd_nav.policy.cadrl import mlp
+from crowd_nav.utils.memory import ReplayMemory, PrioritizedReplayMemory
+from crowd_nav.utils.trainer import Trainer
+
+
+def fill(memory, items):
+    """
+    Fill a memory without pushing items one by one, every item gets the same priority
+
+    """
+    memory.memory = list(items)
+    memory.position = len(memory.memory) % memory.capacity
+    if isinstance(memory, PrioritizedReplayMemory):
+        memory.tree.update(np.arange(len(memory.memory)), memory.max_priority)
+
+
+def sampling_throughput(capacity, batch_size, repeats, input_shape):
+    """
+    Batches per second drawn from a full memory the way Trainer.optimize_batch() draws them, including collation
+    and the priority update of the prioritized memory
+
+    :return: tuple of (uniform, prioritized) batches per second
+    """
+    # all items are the same tensors, only the bookkeeping of the memory grows with its capacity
+    item = (torch.zeros(input_shape), torch.zeros(1))
+    uniform = ReplayMemory(capacity)
+    fill(uniform, [item] * capacity)
+    data_loader = DataLoader(uniform, batch_size, shuffle=True)
+    start = time.time()
+    for _ in range(repeats):
+        next(iter(data_loader))
+    uniform_rate = repeats / (time.time() - start)
+
+    prioritized = PrioritizedReplayMemory(capacity)
+    fill(prioritized, [item] * capacity)
+    start = time.time()
+    for _ in range(repeats):
+        indices, _ = prioritized.sample(batch_size)
+        default_collate([prioritized[index] for index in indices])
+        prioritized.update_priorities(indices, np.random.random(batch_size))
+    prioritized_rate = repeats / (time.time() - start)
+    return uniform_rate, prioritized_rate
+
+
+def sample_efficiency(memory, size, informative, batch_size, batches, evaluation_interval, learning_rate, seed):
+    """
+    Train a value network on a memory where it already fits all but a small fraction of the targets, like a replay
+    memory in which most transitions have near-zero TD errors
+
+    :return: list of the mean squared errors over the whole memory, evaluated every evaluation_interval batches
+    """
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    model = mlp(13, [150, 100, 100, 1])
+    inputs = torch.randn(size, 13)
+    with torch.no_grad():
+        values = model(inputs)
+    # the value changes in a small region of the state space, e.g. close to a collision
+    threshold = torch.quantile(inputs[:, 0], 1 - informative)
+    values += (inputs[:, :1] > threshold).float()
+    fill(memory, zip(inputs, values))
+    trainer = Trainer(model, memory, torch.device('cpu'), batch_size)
+    trainer.set_learning_rate(learning_rate)
+
+    losses = []
+    for _ in range(batches // evaluation_interval):
+        with torch.no_grad():
+            losses.append(trainer.criterion(model(inputs), values).item())
+        trainer.optimize_batch(evaluation_interval)
+    with torch.no_grad():
+        losses.append(trainer.criterion(model(inputs), values).item())
+    return losses
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark prioritized against uniform experience replay')
+    parser.add_argument('--capacities', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--batch_size', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--informative', type=float, default=0.05)
+    parser.add_argument('--batches', type=int, default=2000)
+    parser.add_argument('--evaluation_interval', type=int, default=250)
+    parser.add_argument('--learning_rate', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s, %(levelname)s: %(message)s',
+                        datefmt="%Y-%m-%d %H:%M:%S")
+
+    # SARL input of 5 humans
+    for capacity in args.capacities:
+        uniform_rate, prioritized_rate = sampling_throughput(capacity, args.batch_size, args.repeats, (5, 13))
+        logging.info('Capacity %d: uniform replay samples %.0f batches/s, prioritized replay %.0f batches/s',
+                     capacity, uniform_rate, prioritized_rate)
+
+    memories = [('Uniform', ReplayMemory(args.size)), ('Prioritized', PrioritizedReplayMemory(args.size))]
+    for name, memory in memories:
+        losses = sample_efficiency(memory, args.size, args.informative, args.batch_size, args.batches,
+                                   args.evaluation_interval, args.learning_rate, args.seed)
+        logging.info('%s replay has loss %s after every %d batches', name,
+                     ', '.join('{:.2E}'.format(loss) for loss in losses), args.evaluation_interval)
+
+
+if __name__ == '__main__':
+    main()
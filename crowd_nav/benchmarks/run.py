@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import logging
+import argparse
+import platform
+import configparser
+import torch
+import numpy as np
+from crowd_sim.envs.crowd_sim import CrowdSim
+from crowd_sim.envs.utils.robot import Robot
+from crowd_nav.policy.policy_factory import policy_factory
+from crowd_nav.utils.eval_cache import config_text
+from crowd_nav.utils.explorer import Explorer
+from crowd_nav.utils.memory import ReplayMemory
+from crowd_nav.utils.trainer import Trainer
+
+
+def copy_config(config, overrides=None):
+    """
+    :param overrides: dict from (section, option) to value
+    """
+    copied = configparser.RawConfigParser()
+    copied.read_string(config_text(config))
+    for (section, option), value in (overrides or dict()).items():
+        copied.set(section, option, str(value))
+    return copied
+
+
+def make_env(env_config, policy_config, policy_name, human_num, sim='circle_crossing', phase='test'):
+    """
+    The env is constructed directly instead of with gym.make(), so that no wrapper is timed
+
+    """
+    env_config = copy_config(env_config, {('sim', 'human_num'): human_num, ('sim', 'test_sim'): sim,
+                                          ('sim', 'train_val_sim'): sim, ('env', 'record_mode'): 'off',
+                                          ('env', 'train_record_mode'): 'off'})
+    env = CrowdSim()
+    env.configure(env_config)
+    robot = Robot(env_config, 'robot')
+    policy = policy_factory[policy_name]()
+    if policy.trainable:
+        policy.configure(policy_config)
+        policy.set_device(torch.device('cpu'))
+        policy.set_epsilon(0)
+    policy.set_phase(phase)
+    robot.set_policy(policy)
+    env.set_robot(robot)
+    policy.set_env(env)
+    return env, robot, policy
+
+
+def step_rate(env_config, policy_config, human_num, steps):
+    """
+    :return: env steps per second with a linear robot, the robot's decisions are not timed
+    """
+    env, robot, _ = make_env(env_config, policy_config, 'linear', human_num)
+    ob = env.reset('test')
+    elapsed = 0
+    for _ in range(steps):
+        action = robot.act(ob)
+        start = time.perf_counter()
+        ob, _, done, _ = env.step(action)
+        elapsed += time.perf_counter() - start
+        if done:
+            ob = env.reset('test')
+    return steps / elapsed
+
+
+def reset_latency(env_config, policy_config, sim, resets):
+    """
+    :return: milliseconds per reset of a new test case
+    """
+    env, _, _ = make_env(env_config, policy_config, 'linear', 5, sim)
+    start = time.perf_counter()
+    for _ in range(resets):
+        env.reset('test')
+    return (time.perf_counter() - start) / resets * 1000
+
+
+def predict_latency(env_config, policy_config, policy_name, human_num, decisions):
+    """
+    :return: milliseconds per decision of the robot, stepping the env is not timed
+    """
+    env, robot, _ = make_env(env_config, policy_config, policy_name, human_num)
+    ob = env.reset('test')
+    elapsed = 0
+    for _ in range(decisions):
+        start = time.perf_counter()
+        action = robot.act(ob)
+        elapsed += time.perf_counter() - start
+        ob, _, done, _ = env.step(action)
+        if done:
+            ob = env.reset('test')
+    return elapsed / decisions * 1000
+
+
+def occupancy_map_latency(env_config, policy_config, human_num, repeats):
+    """
+    :return: milliseconds to build the occupancy maps of all humans
+    """
+    env, _, policy = make_env(env_config, copy_config(policy_config, {('sarl', 'with_om'): 'true'}), 'sarl',
+                              human_num)
+    human_states = env.reset('test')
+    start = time.perf_counter()
+    for _ in range(repeats):
+        policy.build_occupancy_maps(human_states)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def update_memory_latency(env_config, policy_config, lazy_targets, repeats):
+    """
+    :return: milliseconds to push one SARL episode into the replay memory
+    """
+    env, robot, policy = make_env(env_config, policy_config, 'sarl', 5, phase='train')
+    memory = ReplayMemory(100000)
+    explorer = Explorer(env, robot, torch.device('cpu'), memory, policy.gamma, target_policy=policy,
+                        lazy_targets=lazy_targets)
+    explorer.update_target_model(policy.get_model())
+    ob = env.reset('train')
+    states = []
+    rewards = []
+    done = False
+    while not done:
+        action = robot.act(ob)
+        ob, reward, done, _ = env.step(action)
+        states.append(policy.last_state)
+        rewards.append(reward)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        explorer.update_memory(states, None, rewards)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def optimize_batch_rate(policy_config, fill, batch_size, batches):
+    """
+    :return: SARL training batches per second with the given number of experiences in the memory
+    """
+    policy = policy_factory['sarl']()
+    policy.configure(policy_config)
+    policy.set_device(torch.device('cpu'))
+    memory = ReplayMemory(100000)
+    # experiences of the same shape as the ones of 5 humans, only the number of them matters
+    item = (torch.randn(5, policy.input_dim()), torch.randn(1))
+    for _ in range(fill):
+        memory.push(item)
+    trainer = Trainer(policy.get_model(), memory, torch.device('cpu'), batch_size)
+    trainer.set_learning_rate(0.001)
+    trainer.optimize_batch(1)
+    start = time.perf_counter()
+    trainer.optimize_batch(batches)
+    return batches / (time.perf_counter() - start)
+
+
+def import_latency(module, repeats):
+    """
+    :return: milliseconds to import a module in a new interpreter, which e.g. every evaluation worker pays
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    command = [sys.executable, '-c', 'import time; start = time.perf_counter(); import {}; '
+                                     'print(time.perf_counter() - start)'.format(module)]
+    # the fastest start has all files in the page cache, like workers started after the first one
+    times = [float(subprocess.check_output(command, env=env, stderr=subprocess.DEVNULL)) for _ in range(repeats)]
+    return min(times) * 1000
+
+
+def benchmarks(args, env_config, policy_config):
+    """
+    :return: list of (name, unit, whether higher is better, function with no arguments)
+    """
+    scale = 0.1 if args.quick else 1
+    cases = []
+    for human_num in [1, 5, 10, 20]:
+        cases.append(('env.step/humans={}'.format(human_num), 'steps/s', True,
+                      lambda human_num=human_num: step_rate(env_config, policy_config, human_num,
+                                                            int(2000 * scale))))
+    for sim in ['circle_crossing', 'square_crossing', 'mixed']:
+        cases.append(('env.reset/{}'.format(sim), 'ms', False,
+                      lambda sim=sim: reset_latency(env_config, policy_config, sim, int(500 * scale))))
+
+    om_config = copy_config(policy_config, {('sarl', 'with_om'): 'true'})
+    for name, policy_name, config in [('orca', 'orca', policy_config), ('cadrl', 'cadrl', policy_config),
+                                      ('lstm_rl', 'lstm_rl', policy_config), ('sarl', 'sarl', policy_config),
+                                      ('om_sarl', 'sarl', om_config)]:
+        for human_num in [5, 10]:
+            # the action space has rotation_samples * speed_samples + 1 actions
+            for rotation_samples in ([None] if not policy_factory[policy_name]().trainable else [7, 16]):
+                overrides = {} if rotation_samples is None else {('action_space', 'rotation_samples'): rotation_samples}
+                actions = '' if rotation_samples is None else '/actions={}'.format(
+                    rotation_samples * config.getint('action_space', 'speed_samples') + 1)
+                cases.append(('predict/{}/humans={}{}'.format(name, human_num, actions), 'ms', False,
+                              lambda policy_name=policy_name, config=copy_config(config, overrides),
+                              human_num=human_num: predict_latency(env_config, config, policy_name, human_num,
+                                                                   max(10, int(100 * scale)))))
+    for human_num in [5, 10, 20]:
+        cases.append(('build_occupancy_maps/humans={}'.format(human_num), 'ms', False,
+                      lambda human_num=human_num: occupancy_map_latency(env_config, policy_config, human_num,
+                                                                        int(200 * scale))))
+    for lazy_targets in [False, True]:
+        cases.append(('update_memory/{}'.format('lazy' if lazy_targets else 'eager'), 'ms', False,
+                      lambda lazy_targets=lazy_targets: update_memory_latency(env_config, policy_config,
+                                                                              lazy_targets, max(2, int(20 * scale)))))
+    for fill in [1000, 10000, 100000]:
+        cases.append(('optimize_batch/fill={}'.format(fill), 'batches/s', True,
+                      lambda fill=fill: optimize_batch_rate(policy_config, fill, 100, max(10, int(100 * scale)))))
+    for module in ['crowd_sim.envs.crowd_sim', 'crowd_sim.envs.policy.orca', 'crowd_nav.policy.policy_factory',
+                   'crowd_nav.utils.explorer']:
+        cases.append(('import/{}'.format(module), 'ms', False,
+                      lambda module=module: import_latency(module, max(1, int(5 * scale)))))
+    return [case for case in cases if args.filter is None or any(key in case[0] for key in args.filter)]
+
+
+def run(args):
+    env_config = configparser.RawConfigParser()
+    env_config.read(args.env_config)
+    policy_config = configparser.RawConfigParser()
+    policy_config.read(args.policy_config)
+    torch.set_num_threads(args.threads)
+
+    results = dict()
+    for name, unit, higher_is_better, function in benchmarks(args, env_config, policy_config):
+        np.random.seed(0)
+        torch.manual_seed(0)
+        # the best of several repeats is the least disturbed by other load on the machine
+        # configuring envs and policies logs their settings, which would drown the results
+        logging.disable(logging.INFO)
+        values = [function() for _ in range(args.repeats)]
+        logging.disable(logging.NOTSET)
+        value = max(values) if higher_is_better else min(values)
+        results[name] = {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+        logging.info('%-45s %12.3f %s', name, value, unit)
+
+    output = {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                       'torch': torch.__version__, 'numpy': np.__version__, 'machine': platform.machine(),
+                       'threads': args.threads, 'quick': args.quick, 'repeats': args.repeats},
+              'results': results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+    logging.info('Results are saved in %s', args.output)
+    if args.baseline is not None:
+        return compare(args.baseline, args.output, args.threshold)
+    return 0
+
+
+def compare(baseline_file, result_file, threshold):
+    """
+    Flag benchmarks that got worse by more than the relative threshold
+
+    :return: number of regressions
+    """
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    with open(result_file, encoding='utf-8') as f:
+        results = json.load(f)['results']
+
+    regressions = 0
+    logging.info('%-45s %12s %12s %8s', 'Benchmark', 'Baseline', 'Current', 'Change')
+    for name in sorted(results):
+        if name not in baseline:
+            logging.info('%-45s %12s %12.3f', name, 'new', results[name]['value'])
+            continue
+        old = baseline[name]['value']
+        new = results[name]['value']
+        # positive changes are improvements
+        change = (new - old) / old if results[name]['higher_is_better'] else (old - new) / old
+        flag = ''
+        if change < -threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif change > threshold:
+            flag = 'improved'
+        logging.info('%-45s %12.3f %12.3f %+7.1f%% %s %s', name, old, new, change * 100, results[name]['unit'],
+                     flag)
+    not_run = len(set(baseline) - set(results))
+    if not_run:
+        logging.info('%d benchmarks of the baseline were not run', not_run)
+    logging.info('%d regressions beyond %.0f%%', regressions, threshold * 100)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark simulation, policies and training and compare against a baseline')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--env_config', type=str, default='configs/env.config')
+    run_parser.add_argument('--policy_config', type=str, default='configs/policy.config')
+    run_parser.add_argument('--output', type=str, default='benchmarks/results.json')
+    run_parser.add_argument('--baseline', type=str, default=None)
+    run_parser.add_argument('--filter', type=str, nargs='+', default=None,
+                            help='only run benchmarks whose name contains one of these strings')
+    run_parser.add_argument('--quick', default=False, action='store_true')
+    run_parser.add_argument('--repeats', type=int, default=3)
+    run_parser.add_argument('--threads', type=int, default=1)
+    run_parser.add_argument('--threshold', type=float, default=0.1)
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('baseline', type=str)
+    compare_parser.add_argument('results', type=str)
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s, %(levelname)s: %(message)s',
+                        datefmt="%Y-%m-%d %H:%M:%S")
+
+    if args.command == 'run':
+        regressions = run(args)
+    else:
+        regressions = compare(args.baseline, args.results, args.threshold)
+    # a non-zero exit status lets scripts stop on regressions
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import copy
+import glob
+import time
+import logging
+import argparse
+import configparser
+import os
+import torch
+import numpy as np
+import gym
+from crowd_sim.envs.utils.robot import Robot
+from crowd_sim.envs.utils.state import JointState
+from crowd_sim.envs.utils.info import ReachGoal, Collision, Timeout, Danger
+from crowd_nav.utils.ensemble import ModelEnsemble
+from crowd_nav.utils.explorer import average
+from crowd_nav.policy.policy_factory import policy_factory
+from crowd_nav.policy.multi_human_rl import MultiHumanRL, full_state_array, observable_state_array
+from crowd_nav.policy.lstm_rl import LstmRL
+
+
+def lookahead_values(policy, ensemble, state, members):
+    """
+    One-step lookahead values of all actions for several models, the lookahead is shared by all of them
+
+    :return: array of shape (# of members, # of actions)
+    """
+    if isinstance(policy, LstmRL):
+        # same order of humans as in LstmRL.predict()
+        position = np.array(state.self_state.position)
+        state.human_states = sorted(state.human_states, reverse=True,
+                                    key=lambda human: np.linalg.norm(np.array(human.position) - position))
+    if policy.action_space is None:
+        policy.build_action_space(state.self_state.v_pref)
+    self_state = np.array([full_state_array(state.self_state)])
+    human_states = np.array([observable_state_array(human_state) for human_state in state.human_states])
+    gamma_bar = pow(policy.gamma, policy.time_step * state.self_state.v_pref)
+    next_self_states, next_human_states, rewards, _ = policy.lookahead(self_state, human_states,
+                                                                       np.arange(len(policy.action_space)))
+    values = ensemble(policy.build_batch_input(next_self_states, next_human_states), members).cpu().numpy()
+    return rewards + gamma_bar * values
+
+
+def run_lockstep(env, policy, ensemble, phase, k, gamma):
+    """
+    Run all models on the same k cases in lockstep. Models choosing the same actions share one simulation, which
+    is copied only when their actions diverge, so scenario generation, human steps and the lookahead are computed
+    once for all models with identical trajectories.
+
+    :return: list of per model lists of (outcome, navigation time, cumulative reward, danger steps, min distances)
+    """
+    results = [[] for _ in range(len(ensemble))]
+    # the policy and configs are shared by all copies of the simulation
+    shared = [policy, env.config]
+    for _ in range(k):
+        ob = env.reset(phase)
+        groups = [(env, list(range(len(ensemble))), ob)]
+        rewards = [[] for _ in range(len(ensemble))]
+        dangers = [[] for _ in range(len(ensemble))]
+        while groups:
+            next_groups = []
+            for group_env, members, ob in groups:
+                robot = group_env.robot
+                state = JointState(robot.get_full_state(), ob)
+                policy.set_env(group_env)
+                if policy.reach_destination(state):
+                    choices = np.zeros(len(members), dtype=int)
+                else:
+                    choices = np.argmax(lookahead_values(policy, ensemble, state, members), axis=1)
+                branches = []
+                for choice in np.unique(choices):
+                    branch = [member for member, member_choice in zip(members, choices) if member_choice == choice]
+                    # copies are made before the group's simulation is stepped
+                    branch_env = group_env if not branches else copy.deepcopy(
+                        group_env, {id(obj): obj for obj in shared})
+                    branches.append((branch_env, branch, policy.action_space[choice]))
+                for branch_env, branch, action in branches:
+                    ob, reward, done, info = branch_env.step(action)
+                    for member in branch:
+                        rewards[member].append(reward)
+                        if isinstance(info, Danger):
+                            dangers[member].append(info.min_dist)
+                    if not done:
+                        next_groups.append((branch_env, branch, ob))
+                        continue
+                    if not isinstance(info, (ReachGoal, Collision, Timeout)):
+                        raise ValueError('Invalid end signal from environment')
+                    for member in branch:
+                        cumulative_reward = sum([pow(gamma, t * robot.time_step * robot.v_pref) * reward
+                                                 for t, reward in enumerate(rewards[member])])
+                        results[member].append((info.__class__.__name__, branch_env.global_time, cumulative_reward,
+                                                len(dangers[member]), dangers[member]))
+            groups = next_groups
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser('Evaluate several checkpoints of a policy in lockstep on the same cases')
+    parser.add_argument('--policy', type=str, default='sarl')
+    parser.add_argument('--model_dir', type=str, required=True)
+    parser.add_argument('--checkpoints', type=str, nargs='+', default=None)
+    parser.add_argument('--phase', type=str, default='test')
+    parser.add_argument('--test_episodes', type=int, default=None)
+    parser.add_argument('--gpu', default=False, action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s, %(levelname)s: %(message)s',
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    device = torch.device("cuda:0" if torch.cuda.is_available() and args.gpu else "cpu")
+    logging.info('Using device: %s', device)
+    checkpoints = args.checkpoints
+    if checkpoints is None:
+        checkpoints = sorted(glob.glob(os.path.join(args.model_dir, '*.pth')))
+
+    # all checkpoints share the architecture of the policy config in the model directory
+    policy = policy_factory[args.policy]()
+    if not isinstance(policy, MultiHumanRL):
+        parser.error('Lockstep evaluation is only supported for multi-human policies')
+    policy_config = configparser.RawConfigParser()
+    policy_config.read(os.path.join(args.model_dir, 'policy.config'))
+    policy.configure(policy_config)
+    policy.set_device(device)
+    policy.set_phase(args.phase)
+    # the lockstep evaluation always takes the best action of the full one-step lookahead
+    ignored = [name for name, enabled in [('[search] depth', policy.search_depth > 1),
+                                          ('[search] cache_size', policy.value_cache.enabled),
+                                          ('[action_space] prune', policy.prune), ('[cem] enabled', policy.cem),
+                                          ('[anytime] deadline', policy.deadline)] if enabled]
+    if ignored:
+        logging.warning('Ignore %s of the policy config, results can differ from the ones of test.py',
+                        ', '.join(ignored))
+    ensemble = ModelEnsemble(policy.get_model().to(device),
+                             [torch.load(checkpoint, map_location=device) for checkpoint in checkpoints])
+
+    env_config = configparser.RawConfigParser()
+    env_config.read(os.path.join(args.model_dir, 'env.config'))
+    env = gym.make('CrowdSim-v0')
+    env.configure(env_config)
+    # episodes are not rendered, so nothing is recorded
+    env.record_mode = 'off'
+    env.train_record_mode = 'off'
+    robot = Robot(env_config, 'robot')
+    robot.set_policy(policy)
+    env.set_robot(robot)
+    policy.set_env(env)
+
+    k = env.case_size[args.phase] if args.test_episodes is None else args.test_episodes
+    start = time.time()
+    results = run_lockstep(env, policy, ensemble, args.phase, k, policy.gamma)
+    logging.info('Evaluated %d checkpoints on %d %s cases in %.2f seconds', len(checkpoints), k, args.phase,
+                 time.time() - start)
+
+    logging.info('{:<40} {:>8} {:>10} {:>8} {:>9} {:>13} {:>7}'.format(
+        'Checkpoint', 'Success', 'Collision', 'Timeout', 'Nav time', 'Total reward', 'Danger'))
+    for checkpoint, episodes in zip(checkpoints, results):
+        outcomes = [episode[0] for episode in episodes]
+        success_times = [episode[1] for episode in episodes if episode[0] == 'ReachGoal']
+        # danger frequency is computed as in Explorer.run_k_episodes()
+        total_time = sum(env.time_limit if episode[0] == 'Timeout' else episode[1] for episode in episodes)
+        logging.info('{:<40} {:>8.2f} {:>10.2f} {:>8.2f} {:>9.2f} {:>13.4f} {:>7.2f}'.format(
+            os.path.relpath(checkpoint, args.model_dir), outcomes.count('ReachGoal') / k,
+            outcomes.count('Collision') / k, outcomes.count('Timeout') / k,
+            average(success_times) if success_times else env.time_limit, average([episode[2] for episode in episodes]),
+            sum(episode[3] for episode in episodes) / (total_time * robot.time_step)))
+
+
+if __name__ == '__main__':
+    main()
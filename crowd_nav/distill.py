@@ -0,0 +1,205 @@
+import sys
+import time
+import logging
+import argparse
+import configparser
+import os
+import shutil
+import torch
+import numpy as np
+import gym
+from crowd_sim.envs.utils.robot import Robot
+from crowd_nav.utils.trainer import Trainer
+from crowd_nav.utils.memory import ReplayMemory
+from crowd_nav.utils.explorer import Explorer
+from crowd_nav.utils.episode_store import EpisodeStore, EpisodeStoreWriter
+from crowd_nav.policy.policy_factory import policy_factory
+from crowd_nav.policy.multi_human_rl import MultiHumanRL
+
+
+def lookahead_states(policy, states):
+    """
+    Propagate recorded states with every action of the action space, humans move with constant velocity
+
+    :param states: array of shape (# of states, # of humans + 1, 9)
+    :return: array of shape (# of states * # of actions, # of humans + 1, 9), actions vary fastest
+    """
+    action_num = len(policy.action_space)
+    next_states = np.repeat(states, action_num, axis=0)
+    next_states[:, 0] = policy.propagate_batch(next_states[:, 0], np.tile(policy.action_array, (len(states), 1)))
+    next_states[:, 1:, :2] += next_states[:, 1:, 2:4] * policy.time_step
+    return next_states
+
+
+def teacher_targets(teacher, store, indices, batch_size):
+    """
+    Build the distillation set from stored episodes. The inputs are the lookahead states of all actions in every
+    stored state and the targets are the values of the teacher for them.
+
+    :return: tuple of (inputs, values) tensors of shape (# of samples, # of humans, input dim) and (# of samples, 1)
+    """
+    inputs = []
+    values = []
+    with torch.no_grad():
+        for i in indices:
+            states = lookahead_states(teacher, np.array(store.episode_states(i)))
+            for start in range(0, len(states), batch_size):
+                batch_input = teacher.transform_batch(states[start:start + batch_size])
+                inputs.append(batch_input.cpu())
+                values.append(teacher.model(batch_input).cpu())
+    return torch.cat(inputs), torch.cat(values)
+
+
+def agreement(model, inputs, values, action_num):
+    """
+    Fraction of states in which the student's best action by value matches the teacher's
+
+    """
+    with torch.no_grad():
+        outputs = model(inputs).view(-1, action_num)
+    return (outputs.argmax(dim=1) == values.view(-1, action_num).argmax(dim=1)).float().mean().item()
+
+
+def decision_latency(model, inputs, repeats=100):
+    """
+    Average time in milliseconds of one forward pass over the action set
+
+    """
+    with torch.no_grad():
+        model(inputs)
+        start = time.time()
+        for _ in range(repeats):
+            model(inputs)
+    return (time.time() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser('Distill a trained multi-human policy into a compact student')
+    parser.add_argument('--teacher_dir', type=str, required=True)
+    parser.add_argument('--teacher_policy', type=str, default='sarl')
+    parser.add_argument('--il', default=False, action='store_true')
+    parser.add_argument('--student_policy', type=str, default=None)
+    parser.add_argument('--student_config', type=str, default='configs/student.config')
+    parser.add_argument('--output_dir', type=str, default='data/student')
+    parser.add_argument('--store_dir', type=str, default=None)
+    parser.add_argument('--episodes', type=int, default=100)
+    parser.add_argument('--epsilon', type=float, default=0.1)
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--batch_size', type=int, default=100)
+    parser.add_argument('--learning_rate', type=float, default=0.01)
+    parser.add_argument('--test_episodes', type=int, default=None)
+    parser.add_argument('--gpu', default=False, action='store_true')
+    args = parser.parse_args()
+    if args.student_policy is None:
+        args.student_policy = args.teacher_policy
+
+    if os.path.exists(args.output_dir):
+        key = input('Output directory already exists! Overwrite the folder? (y/n)')
+        if key != 'y':
+            sys.exit()
+        shutil.rmtree(args.output_dir)
+    os.makedirs(args.output_dir)
+    file_handler = logging.FileHandler(os.path.join(args.output_dir, 'output.log'), mode='w')
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(level=logging.INFO, handlers=[stdout_handler, file_handler],
+                        format='%(asctime)s, %(levelname)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
+    device = torch.device("cuda:0" if torch.cuda.is_available() and args.gpu else "cpu")
+    logging.info('Using device: %s', device)
+
+    # configure teacher and student, the student config only overrides sections of the teacher's config
+    teacher_config_file = os.path.join(args.teacher_dir, 'policy.config')
+    env_config_file = os.path.join(args.teacher_dir, 'env.config')
+    teacher_weights = os.path.join(args.teacher_dir, 'il_model.pth' if args.il else 'rl_model.pth')
+    teacher = policy_factory[args.teacher_policy]()
+    student = policy_factory[args.student_policy]()
+    if not isinstance(teacher, MultiHumanRL) or not isinstance(student, MultiHumanRL):
+        parser.error('Teacher and student have to be multi-human policies')
+    teacher_config = configparser.RawConfigParser()
+    teacher_config.read(teacher_config_file)
+    teacher.configure(teacher_config)
+    teacher.get_model().load_state_dict(torch.load(teacher_weights))
+    student_config = configparser.RawConfigParser()
+    student_config.read([teacher_config_file, args.student_config])
+    student.configure(student_config)
+    if student.input_dim() != teacher.input_dim():
+        parser.error('Student has to take the same input as the teacher')
+    for policy in [teacher, student]:
+        policy.set_device(device)
+        policy.set_phase('test')
+
+    env_config = configparser.RawConfigParser()
+    env_config.read(env_config_file)
+    env = gym.make('CrowdSim-v0')
+    env.configure(env_config)
+    robot = Robot(env_config, 'robot')
+    env.set_robot(robot)
+    robot.set_policy(teacher)
+    teacher.set_env(env)
+    explorer = Explorer(env, robot, device, gamma=teacher.gamma)
+
+    # states are taken from recorded episodes or sampled with the teacher
+    if args.store_dir is None:
+        args.store_dir = os.path.join(args.output_dir, 'episodes')
+        env.train_record_mode = 'array'
+        teacher.set_epsilon(args.epsilon)
+        episode_store = EpisodeStoreWriter(args.store_dir, env, 'train')
+        explorer.run_k_episodes(args.episodes, 'train', episode_store=episode_store)
+        episode_store.close()
+        teacher.set_phase('test')
+    store = EpisodeStore(args.store_dir)
+    teacher.time_step = store.time_step
+    teacher.build_action_space(store.episode_states(0)[0, 0, 7])
+    action_num = len(teacher.action_space)
+
+    # episodes with a different number of humans can't be batched together
+    human_nums = store.episodes['human_num']
+    human_num = np.bincount(human_nums).argmax()
+    indices = np.flatnonzero(human_nums == human_num)
+    if len(indices) < len(store):
+        logging.warning('Skip %d episodes with a different number of humans than %d', len(store) - len(indices),
+                        human_num)
+    val_size = max(1, len(indices) // 10)
+    train_inputs, train_values = teacher_targets(teacher, store, indices[:-val_size], args.batch_size * action_num)
+    val_inputs, val_values = teacher_targets(teacher, store, indices[-val_size:], args.batch_size * action_num)
+    logging.info('Distill values of %d lookahead states of %d episodes', len(train_values), len(indices) - val_size)
+
+    # train the student to match the teacher's values over the action set
+    memory = ReplayMemory(len(train_values))
+    for item in zip(train_inputs.to(device), train_values.to(device)):
+        memory.push(item)
+    model = student.get_model()
+    trainer = Trainer(model, memory, device, args.batch_size)
+    trainer.set_learning_rate(args.learning_rate)
+    val_inputs = val_inputs.to(device)
+    val_values = val_values.to(device)
+    for epoch in range(args.epochs):
+        train_loss = trainer.optimize_epoch(1)
+        with torch.no_grad():
+            val_loss = trainer.criterion(model(val_inputs), val_values).item()
+        logging.info('Epoch %d has train loss: %.2E, validation loss: %.2E, action agreement: %.2f', epoch,
+                     train_loss, val_loss, agreement(model, val_inputs, val_values, action_num))
+
+    # the student is saved like a trained model, so it can be evaluated with test.py
+    torch.save(model.state_dict(), os.path.join(args.output_dir, 'rl_model.pth'))
+    shutil.copy(env_config_file, os.path.join(args.output_dir, 'env.config'))
+    with open(os.path.join(args.output_dir, 'policy.config'), 'w') as f:
+        student_config.write(f)
+    logging.info('Student is saved in %s', args.output_dir)
+
+    # benchmark the student against the teacher
+    test_episodes = env.case_size['test'] if args.test_episodes is None else args.test_episodes
+    for name, policy in [('Teacher', teacher), ('Student', student)]:
+        parameters = sum(parameter.numel() for parameter in policy.get_model().parameters())
+        latency = decision_latency(policy.get_model(), val_inputs[:action_num])
+        logging.info('%s has %d parameters and takes %.3f ms to evaluate %d actions', name, parameters, latency,
+                     action_num)
+        robot.set_policy(policy)
+        policy.set_env(env)
+        env.case_counter['test'] = 0
+        start = time.time()
+        explorer.run_k_episodes(test_episodes, 'test')
+        logging.info('%s takes %.2f seconds for %d test episodes', name, time.time() - start, test_episodes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import os
+import time
+import logging
+import argparse
+import numpy as np
+from crowd_nav.utils.episode_store import EpisodeStore
+from crowd_nav.utils.heatmap import trajectory_histograms, plot_heatmaps
+
+
+def main():
+    parser = argparse.ArgumentParser('Plot robot occupancy, collision and discomfort heatmaps of stored runs')
+    parser.add_argument('store_dirs', type=str, nargs='+')
+    parser.add_argument('--output_dir', type=str, default=None)
+    parser.add_argument('--bins', type=int, default=100)
+    parser.add_argument('--extent', type=float, default=6)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s, %(levelname)s: %(message)s',
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    for store_dir in args.store_dirs:
+        start = time.time()
+        store = EpisodeStore(store_dir)
+        histograms = trajectory_histograms(store, args.bins, args.extent)
+        logging.info('Binned %d steps of %d episodes in %s in %.2f seconds', len(store.rewards), len(store),
+                     store_dir, time.time() - start)
+
+        output_dir = args.output_dir if args.output_dir is not None else store_dir
+        os.makedirs(output_dir, exist_ok=True)
+        name = os.path.basename(os.path.normpath(store_dir))
+        np.savez_compressed(os.path.join(output_dir, '{}_heatmaps.npz'.format(name)), **histograms)
+        output_file = os.path.join(output_dir, '{}_heatmaps.png'.format(name))
+        plot_heatmaps(histograms, args.extent, name, output_file)
+        logging.info('Heatmaps are saved in %s', output_file)
+
+
+if __name__ == '__main__':
+    main()
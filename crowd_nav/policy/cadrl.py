@@ -6,6 +6,7 @@ import logging
 from crowd_sim.envs.policy.policy import Policy
 from crowd_sim.envs.utils.action import ActionRot, ActionXY
 from crowd_sim.envs.utils.state import ObservableState, FullState
+from crowd_sim.envs.utils import timing
 
 
 def mlp(input_dim, mlp_dims, last_relu=False):
@@ -184,6 +185,20 @@ class CADRL(Policy):
         state = self.rotate(state.unsqueeze(0)).squeeze(dim=0)
         return state
 
+    def transform_batch(self, states):
+        """
+        Transform recorded states into rotated joint states of the robot and each human
+
+        :param states: array of shape (batch_size, # of humans + 1, 9), the first agent is the robot
+        :return: tensor of shape (batch_size, # of humans, self.joint_state_dim)
+        """
+        states = torch.as_tensor(np.asarray(states), dtype=torch.float32)
+        batch_size, agent_num, _ = states.shape
+        self_states = states[:, :1, :].expand(batch_size, agent_num - 1, states.shape[2])
+        joint_states = torch.cat([self_states, states[:, 1:, :5]], dim=2).reshape(batch_size * (agent_num - 1), -1)
+        with timing.timer('policy.rotate'):
+            return self.rotate(joint_states.to(self.device)).view(batch_size, agent_num - 1, -1)
+
     def rotate(self, state):
         """
         Transform the coordinate to agent-centric.
@@ -103,3 +103,13 @@ class LstmRL(MultiHumanRL):
         state.human_states = sorted(state.human_states, key=dist, reverse=True)
         return super().predict(state)
 
+    def transform_batch(self, states):
+        """
+        Sort humans by decreasing distance to the robot as in predict() before transforming
+
+        """
+        states = np.asarray(states)
+        dist = np.linalg.norm(states[:, 1:, :2] - states[:, :1, :2], axis=2)
+        order = np.argsort(-dist, axis=1, kind='stable')
+        human_states = np.take_along_axis(states[:, 1:], order[:, :, np.newaxis], axis=1)
+        return super().transform_batch(np.concatenate([states[:, :1], human_states], axis=1))
@@ -1,12 +1,84 @@
+import time
+import logging
 import torch
 import numpy as np
 from crowd_sim.envs.utils.action import ActionRot, ActionXY
+from crowd_sim.envs.utils.state import ObservableState
+from crowd_sim.envs.utils import timing
+from crowd_sim.envs.policy.policy_factory import policy_factory
 from crowd_nav.policy.cadrl import CADRL
+from crowd_nav.utils.value_cache import ValueCache
+
+
+def full_state_array(state):
+    return state.px, state.py, state.vx, state.vy, state.radius, state.gx, state.gy, state.v_pref, state.theta
+
+
+def observable_state_array(state):
+    return state.px, state.py, state.vx, state.vy, state.radius
 
 
 class MultiHumanRL(CADRL):
     def __init__(self):
         super().__init__()
+        self.action_array = None
+        self.search_depth = None
+        self.beam_width = None
+        self.time_budget = None
+        self.value_cache = None
+        self.prune = None
+        self.prune_verify = None
+        self.pruning_stats = {'decisions': 0, 'actions': 0, 'pruned': 0, 'mismatches': 0}
+        self.cem = None
+        self.cem_iterations = None
+        self.cem_population = None
+        self.cem_elite_fraction = None
+        self.deadline = None
+        self.chunk_size = None
+        self.chunk_time = 0
+        self.fallback_policy = None
+        self.last_action_index = None
+        # attention weights of the rows of the last evaluated batch and of the chosen action, if the model has them
+        self.batch_attention_weights = None
+        self.attention_weights = None
+        self.anytime_stats = {'latencies': [], 'misses': 0, 'fallbacks': 0, 'partial': 0}
+
+    def set_common_parameters(self, config):
+        super().set_common_parameters(config)
+        self.search_depth = config.getint('search', 'depth', fallback=1)
+        self.beam_width = config.getint('search', 'beam_width', fallback=5)
+        self.time_budget = config.getfloat('search', 'time_budget', fallback=0)
+        self.value_cache = ValueCache(config.getint('search', 'cache_size', fallback=0),
+                                      config.getfloat('search', 'cache_resolution', fallback=0.01))
+        self.prune = config.getboolean('action_space', 'prune', fallback=False)
+        self.prune_verify = config.getboolean('action_space', 'prune_verify', fallback=False)
+        self.cem = config.getboolean('cem', 'enabled', fallback=False)
+        self.cem_iterations = config.getint('cem', 'iterations', fallback=3)
+        self.cem_population = config.getint('cem', 'population', fallback=11)
+        self.cem_elite_fraction = config.getfloat('cem', 'elite_fraction', fallback=0.25)
+        self.deadline = config.getfloat('anytime', 'deadline', fallback=0)
+        self.chunk_size = config.getint('anytime', 'chunk_size', fallback=8)
+        self.fallback_policy = policy_factory[config.get('anytime', 'fallback', fallback='linear')]()
+        if self.deadline:
+            logging.info('Anytime action selection with a deadline of %g ms', self.deadline)
+        if self.cem:
+            logging.info('Continuous actions with the cross-entropy method: %d iterations of %d samples',
+                         self.cem_iterations, self.cem_population)
+        if self.search_depth > 1:
+            logging.info('Lookahead search with depth %d and beam width %d', self.search_depth, self.beam_width)
+        if self.prune:
+            logging.info('Prune colliding and goal-averse actions before evaluation%s',
+                         ' and verify the chosen actions' if self.prune_verify else '')
+
+    def set_phase(self, phase):
+        self.phase = phase
+        # cached values are only valid as long as the model is not updated
+        if self.value_cache is not None:
+            self.value_cache.clear()
+
+    def build_action_space(self, v_pref):
+        super().build_action_space(v_pref)
+        self.action_array = np.array(self.action_space, dtype=float)
 
     def predict(self, state):
         """
@@ -19,49 +91,442 @@ class MultiHumanRL(CADRL):
         if self.phase == 'train' and self.epsilon is None:
             raise AttributeError('Epsilon attribute has to be set in training phase')
 
+        start = time.time()
         if self.reach_destination(state):
+            self.last_action_index = None
             return ActionXY(0, 0) if self.kinematics == 'holonomic' else ActionRot(0, 0)
         if self.action_space is None:
             self.build_action_space(state.self_state.v_pref)
 
-        occupancy_maps = None
         probability = np.random.random()
         if self.phase == 'train' and probability < self.epsilon:
             max_action = self.action_space[np.random.choice(len(self.action_space))]
+        elif self.cem:
+            max_action = self.optimize_action(state)
+        elif self.deadline:
+            max_action = self.anytime_search(state, start)
         else:
-            self.action_values = list()
-            max_value = float('-inf')
-            max_action = None
-            for action in self.action_space:
-                next_self_state = self.propagate(state.self_state, action)
-                if self.query_env:
-                    next_human_states, reward, done, info = self.env.onestep_lookahead(action)
-                else:
-                    next_human_states = [self.propagate(human_state, ActionXY(human_state.vx, human_state.vy))
-                                       for human_state in state.human_states]
-                    reward = self.compute_reward(next_self_state, next_human_states)
-                batch_next_states = torch.cat([torch.Tensor([next_self_state + next_human_state]).to(self.device)
-                                              for next_human_state in next_human_states], dim=0)
-                rotated_batch_input = self.rotate(batch_next_states).unsqueeze(0)
-                if self.with_om:
-                    if occupancy_maps is None:
-                        occupancy_maps = self.build_occupancy_maps(next_human_states).unsqueeze(0)
-                    rotated_batch_input = torch.cat([rotated_batch_input, occupancy_maps], dim=2)
-                # VALUE UPDATE
-                next_state_value = self.model(rotated_batch_input).data.item()
-                value = reward + pow(self.gamma, self.time_step * state.self_state.v_pref) * next_state_value
-                self.action_values.append(value)
-                if value > max_value:
-                    max_value = value
-                    max_action = action
-            if max_action is None:
-                raise ValueError('Value network is not well trained. ')
+            max_index = self.search(state, self.prune)
+            if self.prune and self.prune_verify:
+                # check that pruning doesn't change the decision
+                action_values = self.action_values
+                if self.search(state, prune=False) != max_index:
+                    self.pruning_stats['mismatches'] += 1
+                self.action_values = action_values
+            max_action = self.action_space[max_index]
 
         if self.phase == 'train':
             self.last_state = self.transform(state)
+        if self.deadline:
+            latency = time.time() - start
+            self.anytime_stats['latencies'].append(latency)
+            if latency * 1000 > self.deadline:
+                self.anytime_stats['misses'] += 1
 
         return max_action
 
+    def search(self, state, prune=False):
+        """
+        Select an action with a depth-limited beam search over the action space. The first level is the one-step
+        lookahead of all actions, deeper levels propagate humans with constant velocity and only expand the
+        beam_width best nodes. All leaf states of one level are evaluated in one batched forward pass.
+
+        :param prune: discard hopeless actions with prune_actions() before the lookahead
+        :return: index of the best action in the action space
+        """
+        start = time.time()
+        self_state = np.array([full_state_array(state.self_state)])
+        gamma_bar = pow(self.gamma, self.time_step * state.self_state.v_pref)
+        action_num = len(self.action_space)
+
+        # one-step lookahead
+        current_human_states = np.array([observable_state_array(human_state) for human_state in state.human_states])
+        candidates = np.arange(action_num)
+        if prune:
+            next_self_states = self.propagate_batch(np.repeat(self_state, action_num, axis=0), self.action_array)
+            candidates = self.prune_actions(self_state[0], next_self_states, current_human_states)
+        next_self_states, human_states, rewards, dones = self.lookahead(self_state, current_human_states, candidates)
+        values = self.evaluate_batch(next_self_states, human_states)
+        first_attention_weights = self.batch_attention_weights
+        # VALUE UPDATE
+        candidate_values = rewards + gamma_bar * values
+        if np.all(np.isnan(candidate_values)):
+            raise ValueError('Value network is not well trained. ')
+        # pruned actions have no value
+        action_values = np.full(action_num, np.nan)
+        action_values[candidates] = candidate_values
+        self.action_values = action_values.tolist()
+        best_action = int(candidates[np.nanargmax(candidate_values)])
+
+        # frontier of the search tree, a terminal node is not expanded and keeps its return as score
+        first_actions = candidates
+        self_states = next_self_states
+        returns = rewards
+        discounts = np.full(len(candidates), gamma_bar)
+        scores = np.where(dones, rewards, candidate_values)
+        for _ in range(self.search_depth - 1):
+            if self.time_budget and (time.time() - start) * 1000 > self.time_budget:
+                break
+            expandable = np.flatnonzero(~dones)
+            if len(expandable) == 0:
+                break
+            beam = expandable[np.argsort(-scores[expandable], kind='stable')[:self.beam_width]]
+            parents = np.repeat(beam, action_num)
+            human_states = self.propagate_humans(human_states)
+            child_states = self.propagate_batch(self_states[parents], np.tile(self.action_array, (len(beam), 1)))
+            child_rewards, child_dones = self.compute_reward_batch(child_states, human_states)
+            child_values = self.evaluate_batch(child_states, human_states)
+            child_returns = returns[parents] + discounts[parents] * child_rewards
+            child_discounts = discounts[parents] * gamma_bar
+            child_scores = np.where(child_dones, child_returns, child_returns + child_discounts * child_values)
+
+            terminal = np.flatnonzero(dones)
+            first_actions = np.concatenate([first_actions[terminal], first_actions[parents]])
+            self_states = np.concatenate([self_states[terminal], child_states])
+            returns = np.concatenate([returns[terminal], child_returns])
+            discounts = np.concatenate([discounts[terminal], child_discounts])
+            dones = np.concatenate([dones[terminal], child_dones])
+            scores = np.concatenate([scores[terminal], child_scores])
+            best_action = int(first_actions[np.nanargmax(scores)])
+
+        if first_attention_weights is not None:
+            self.attention_weights = first_attention_weights[np.flatnonzero(candidates == best_action)[0]]
+        return best_action
+
+    def optimize_action(self, state):
+        """
+        Search the continuous action space with the cross-entropy method. Every iteration samples a population of
+        (vx, vy) or (v, r) actions from a Gaussian, scores it with one batched one-step lookahead and refits the
+        Gaussian to the elite actions. The best action found so far is carried over to the next population.
+
+        :return: the best action found
+        """
+        holonomic = self.kinematics == 'holonomic'
+        v_pref = state.self_state.v_pref
+        self_state = np.array([full_state_array(state.self_state)])
+        gamma_bar = pow(self.gamma, self.time_step * v_pref)
+        if self.query_env:
+            # next states of humans don't depend on the action of the robot, so the env is queried only once
+            next_human_states, _, _, _ = self.env.onestep_lookahead(self.action_space[0])
+            human_states = np.array([observable_state_array(human_state) for human_state in next_human_states])
+        else:
+            human_states = self.propagate_humans(np.array([observable_state_array(human_state)
+                                                           for human_state in state.human_states]))
+
+        if holonomic:
+            low = np.array([-v_pref, -v_pref])
+            high = np.array([v_pref, v_pref])
+        else:
+            low = np.array([0, -np.pi / 4])
+            high = np.array([v_pref, np.pi / 4])
+        mean = (low + high) / 2
+        std = (high - low) / 2
+        elite_num = max(1, int(round(self.cem_population * self.cem_elite_fraction)))
+        # start from the stop action
+        best_action = np.zeros(2)
+        best_value = float('-inf')
+        for _ in range(self.cem_iterations):
+            actions = np.clip(np.random.normal(mean, std, (self.cem_population, 2)), low, high)
+            if holonomic:
+                speeds = np.linalg.norm(actions, axis=1, keepdims=True)
+                actions *= np.minimum(1, v_pref / np.maximum(speeds, 1e-12))
+            actions = np.concatenate([best_action[np.newaxis], actions])
+            next_self_states = self.propagate_batch(np.repeat(self_state, len(actions), axis=0), actions)
+            rewards, _ = self.compute_reward_batch(next_self_states, human_states)
+            values = rewards + gamma_bar * self.evaluate_batch(next_self_states, human_states)
+            if np.all(np.isnan(values)):
+                raise ValueError('Value network is not well trained. ')
+            elites = np.argsort(-np.nan_to_num(values, nan=float('-inf')), kind='stable')[:elite_num]
+            if values[elites[0]] > best_value:
+                best_action = actions[elites[0]]
+                best_value = values[elites[0]]
+                if self.batch_attention_weights is not None:
+                    self.attention_weights = self.batch_attention_weights[elites[0]]
+            mean = actions[elites].mean(axis=0)
+            std = actions[elites].std(axis=0)
+        # values of sampled actions can't be laid out on the action space
+        self.action_values = None
+
+        return ActionXY(*best_action) if holonomic else ActionRot(*best_action)
+
+    def lookahead(self, self_state, human_states, candidates):
+        """
+        One-step lookahead of the given actions. The env is queried for every action if query_env is set,
+        otherwise humans move with constant velocity.
+
+        :param self_state: array of shape (1, 9)
+        :param human_states: current human states, array of shape (# of humans, 5)
+        :param candidates: indices of the actions in the action space
+        :return: next robot states, next human states, rewards and done flags of the actions
+        """
+        with timing.timer('policy.propagate'):
+            next_self_states = self.propagate_batch(np.repeat(self_state, len(candidates), axis=0),
+                                                    self.action_array[candidates])
+            if self.query_env:
+                rewards = np.zeros(len(candidates))
+                dones = np.zeros(len(candidates), dtype=bool)
+                for i, index in enumerate(candidates):
+                    next_human_states, rewards[i], dones[i], _ = self.env.onestep_lookahead(self.action_space[index])
+                next_human_states = np.array([observable_state_array(human_state)
+                                              for human_state in next_human_states])
+            else:
+                next_human_states = self.propagate_humans(human_states)
+                rewards, dones = self.compute_reward_batch(next_self_states, next_human_states)
+        return next_self_states, next_human_states, rewards, dones
+
+    def anytime_search(self, state, start):
+        """
+        Evaluate the one-step lookahead of actions in priority order in batched chunks until the deadline. A chunk
+        is only started if it is expected to finish in time. If no action could be evaluated, the action of the
+        fallback policy is returned.
+
+        :param start: time when the decision started
+        :return: the best action evaluated so far
+        """
+        self_state = np.array([full_state_array(state.self_state)])
+        gamma_bar = pow(self.gamma, self.time_step * state.self_state.v_pref)
+        current_human_states = np.array([observable_state_array(human_state) for human_state in state.human_states])
+        order = self.action_priorities(self_state[0])
+        action_values = np.full(len(self.action_space), np.nan)
+        attention_weights = None
+        deadline = start + self.deadline / 1000
+        evaluated = 0
+        while evaluated < len(order) and time.time() + self.chunk_time <= deadline:
+            chunk_start = time.time()
+            candidates = order[evaluated:evaluated + self.chunk_size]
+            next_self_states, human_states, rewards, _ = self.lookahead(self_state, current_human_states, candidates)
+            action_values[candidates] = rewards + gamma_bar * self.evaluate_batch(next_self_states, human_states)
+            if self.batch_attention_weights is not None:
+                if attention_weights is None:
+                    attention_weights = np.full((len(self.action_space), len(human_states)), np.nan)
+                attention_weights[candidates] = self.batch_attention_weights
+            evaluated += len(candidates)
+            # moving average of the time one chunk takes
+            chunk_time = time.time() - chunk_start
+            self.chunk_time = chunk_time if not self.chunk_time else 0.8 * self.chunk_time + 0.2 * chunk_time
+        self.action_values = action_values.tolist()
+
+        if evaluated == 0:
+            # decay the estimate so that a single slow chunk doesn't disable the evaluation for good
+            self.chunk_time *= 0.5
+            self.anytime_stats['fallbacks'] += 1
+            self.last_action_index = None
+            return self.fallback_action(state)
+        if np.all(np.isnan(action_values)):
+            raise ValueError('Value network is not well trained. ')
+        if evaluated < len(order):
+            self.anytime_stats['partial'] += 1
+        self.last_action_index = int(np.nanargmax(action_values))
+        if attention_weights is not None:
+            self.attention_weights = attention_weights[self.last_action_index]
+        return self.action_space[self.last_action_index]
+
+    def action_priorities(self, self_state):
+        """
+        Order the action space for anytime evaluation: the previous action and its neighbors in the action grid
+        come first, then the stop action, then all other actions by their deviation from the goal direction with
+        faster actions first
+
+        :param self_state: array of shape (9, )
+        :return: array of action indices
+        """
+        holonomic = self.kinematics == 'holonomic'
+        if holonomic:
+            headings = np.arctan2(self.action_array[:, 1], self.action_array[:, 0])
+            speeds = np.linalg.norm(self.action_array, axis=1)
+        else:
+            headings = self_state[8] + self.action_array[:, 1]
+            speeds = self.action_array[:, 0]
+        goal_heading = np.arctan2(self_state[6] - self_state[1], self_state[5] - self_state[0])
+        deviation = np.abs((headings - goal_heading + np.pi) % (2 * np.pi) - np.pi)
+
+        priority = np.full(len(self.action_space), 2)
+        priority[0] = 1
+        if self.last_action_index:
+            # position of actions in the grid of rotations and speeds built by build_action_space
+            grid = np.arange(len(self.action_space)) - 1
+            rotation_dist = np.abs(grid // self.speed_samples - (self.last_action_index - 1) // self.speed_samples)
+            if holonomic:
+                rotation_dist = np.minimum(rotation_dist, self.rotation_samples - rotation_dist)
+            speed_dist = np.abs(grid % self.speed_samples - (self.last_action_index - 1) % self.speed_samples)
+            neighbors = (rotation_dist <= 1) & (speed_dist <= 1)
+            neighbors[0] = False
+            priority[neighbors] = 0
+        return np.lexsort((-speeds, deviation, priority))
+
+    def fallback_action(self, state):
+        """
+        Action of the cheap fallback policy, converted to the kinematics of the robot
+
+        """
+        self.fallback_policy.time_step = self.time_step
+        action = self.fallback_policy.predict(state)
+        if self.kinematics == 'holonomic':
+            return action
+        rotation = (np.arctan2(action.vy, action.vx) - state.self_state.theta + np.pi) % (2 * np.pi) - np.pi
+        return ActionRot(np.linalg.norm((action.vx, action.vy)), rotation)
+
+    def prune_actions(self, self_state, next_self_states, human_states):
+        """
+        Cheap geometric pre-screen of all actions against all humans. An action is discarded if the robot collides
+        with a human moving at constant velocity within the next step, which is the collision check of the
+        environment, or if it moves away from the goal at full speed. All actions are kept if none survives.
+
+        :param self_state: array of shape (9, )
+        :param next_self_states: propagated robot states of all actions, array of shape (# of actions, 9)
+        :param human_states: current human states, array of shape (# of humans, 5)
+        :return: indices of the remaining actions
+        """
+        # relative motion of humans in the robot frame during the next step
+        positions = human_states[np.newaxis, :, :2] - self_state[np.newaxis, np.newaxis, :2]
+        velocities = human_states[np.newaxis, :, 2:4] - next_self_states[:, np.newaxis, 2:4]
+        speeds = np.sum(velocities ** 2, axis=2)
+        closest_time = np.clip(-np.sum(positions * velocities, axis=2) / np.maximum(speeds, 1e-12), 0,
+                               self.time_step)
+        closest_dist = np.linalg.norm(positions + velocities * closest_time[:, :, np.newaxis], axis=2) \
+            - human_states[np.newaxis, :, 4] - self_state[4]
+        collision = np.any(closest_dist < 0, axis=1)
+
+        goal_direction = self_state[5:7] - self_state[:2]
+        full_speed = np.linalg.norm(next_self_states[:, 2:4], axis=1) >= self_state[7] * 0.99
+        away_from_goal = np.dot(next_self_states[:, 2:4], goal_direction) < 0
+        keep = np.flatnonzero(~(collision | (full_speed & away_from_goal)))
+        if len(keep) == 0:
+            keep = np.arange(len(next_self_states))
+
+        self.pruning_stats['decisions'] += 1
+        self.pruning_stats['actions'] += len(next_self_states)
+        self.pruning_stats['pruned'] += len(next_self_states) - len(keep)
+        return keep
+
+    def log_statistics(self):
+        """
+        Log and reset the statistics collected since the last call
+
+        """
+        stats = self.pruning_stats
+        if self.prune and stats['decisions']:
+            logging.info('Pruned action rate: %.2f in %d decisions', stats['pruned'] / stats['actions'],
+                         stats['decisions'])
+            if self.prune_verify:
+                logging.info('Decisions changed by pruning: %d', stats['mismatches'])
+        self.pruning_stats = {'decisions': 0, 'actions': 0, 'pruned': 0, 'mismatches': 0}
+
+        stats = self.anytime_stats
+        if self.deadline and stats['latencies']:
+            latencies = np.array(stats['latencies']) * 1000
+            logging.info('Decision latency in ms: p50 %.2f, p90 %.2f, p99 %.2f, max %.2f', *np.percentile(
+                latencies, [50, 90, 99, 100]))
+            logging.info('Deadline misses: %d, partial decisions: %d and fallbacks: %d in %d decisions',
+                         stats['misses'], stats['partial'], stats['fallbacks'], len(latencies))
+        self.anytime_stats = {'latencies': [], 'misses': 0, 'fallbacks': 0, 'partial': 0}
+
+        cache = self.value_cache
+        if cache is not None and cache.enabled and cache.hits + cache.misses:
+            logging.info('Value cache hit rate: %.2f in %d lookups, %d/%d values cached',
+                         cache.hits / (cache.hits + cache.misses), cache.hits + cache.misses, len(cache.values),
+                         cache.capacity)
+        if cache is not None:
+            cache.hits = 0
+            cache.misses = 0
+
+    def propagate_batch(self, self_states, actions):
+        """
+        Propagate full states of the robot with the given actions, same as propagate() for a batch
+
+        :param self_states: array of shape (batch_size, 9)
+        :param actions: array of shape (batch_size, 2) of (vx, vy) or (v, r)
+        :return: array of shape (batch_size, 9)
+        """
+        next_states = self_states.copy()
+        if self.kinematics == 'holonomic':
+            next_states[:, 2:4] = actions
+        else:
+            next_states[:, 8] = self_states[:, 8] + actions[:, 1]
+            next_states[:, 2] = actions[:, 0] * np.cos(next_states[:, 8])
+            next_states[:, 3] = actions[:, 0] * np.sin(next_states[:, 8])
+        next_states[:, :2] += next_states[:, 2:4] * self.time_step
+        return next_states
+
+    def propagate_humans(self, human_states):
+        """
+        Propagate observable states of humans of shape (# of humans, 5) with constant velocity
+
+        """
+        next_states = human_states.copy()
+        next_states[:, :2] += next_states[:, 2:4] * self.time_step
+        return next_states
+
+    def compute_reward_batch(self, next_self_states, next_human_states):
+        """
+        Same as compute_reward() for a batch of robot states against the same human states
+
+        :param next_self_states: array of shape (batch_size, 9)
+        :param next_human_states: array of shape (# of humans, 5)
+        :return: rewards and done flags of shape (batch_size, )
+        """
+        dist = np.linalg.norm(next_self_states[:, np.newaxis, :2] - next_human_states[np.newaxis, :, :2], axis=2) \
+            - next_self_states[:, 4:5] - next_human_states[np.newaxis, :, 4]
+        dmin = dist.min(axis=1)
+        collision = dmin < 0
+        reaching_goal = np.linalg.norm(next_self_states[:, :2] - next_self_states[:, 5:7], axis=1) < \
+            next_self_states[:, 4]
+        rewards = np.where(collision, -0.25, np.where(reaching_goal, 1,
+                                                      np.where(dmin < 0.2, (dmin - 0.2) * 0.5 * self.time_step, 0)))
+        return rewards, collision | reaching_goal
+
+    def build_batch_input(self, self_states, human_states):
+        """
+        Build the value network input for a batch of robot states against the same human states
+
+        :param self_states: array of shape (batch_size, 9)
+        :param human_states: array of shape (# of humans, 5)
+        :return: tensor of shape (batch_size, # of humans, self.input_dim())
+        """
+        states = np.zeros((len(self_states), len(human_states) + 1, self_states.shape[1]))
+        states[:, 0] = self_states
+        states[:, 1:, :5] = human_states
+        # humans are already ordered by predict(), so the plain joint state transformation is used
+        with timing.timer('policy.tensor_build'):
+            batch_input = CADRL.transform_batch(self, states)
+        if self.with_om:
+            with timing.timer('policy.om_build'):
+                occupancy_maps = self.build_occupancy_maps([ObservableState(*human_state)
+                                                            for human_state in human_states])
+            batch_input = torch.cat([batch_input, occupancy_maps.to(self.device).unsqueeze(0).
+                                    expand(len(self_states), -1, -1)], dim=2)
+        return batch_input
+
+    def evaluate_batch(self, self_states, human_states):
+        """
+        Evaluate the value network for a batch of robot states against the same human states in one forward pass,
+        values found in the transposition cache are not recomputed. The attention weights of the rows are kept in
+        batch_attention_weights if the model computes them, the cache stores them next to the values.
+
+        :return: array of shape (batch_size, )
+        """
+        batch_input = self.build_batch_input(self_states, human_states)
+        with torch.no_grad():
+            if not self.value_cache.enabled or self.phase == 'train':
+                timing.count('policy.forward_states', len(batch_input))
+                with timing.timer('policy.forward'):
+                    values = self.model(batch_input).squeeze(1).cpu().numpy()
+                self.batch_attention_weights = getattr(self.model, 'attention_weights', None)
+                return values
+            keys = self.value_cache.keys(batch_input)
+            entries = [self.value_cache.get(key) for key in keys]
+            missing = [i for i, entry in enumerate(entries) if entry is None]
+            if missing:
+                timing.count('policy.forward_states', len(missing))
+                with timing.timer('policy.forward'):
+                    values = self.model(batch_input[torch.tensor(missing)]).squeeze(1).cpu().numpy()
+                attention_weights = getattr(self.model, 'attention_weights', None)
+                for j, i in enumerate(missing):
+                    entries[i] = (values[j], None if attention_weights is None else attention_weights[j])
+                    self.value_cache.put(keys[i], entries[i])
+        self.batch_attention_weights = None if entries[0][1] is None else np.array([entry[1] for entry in entries])
+        return np.array([entry[0] for entry in entries], dtype=float)
+
     def compute_reward(self, nav, humans):
         # collision detection
         dmin = float('inf')
@@ -103,6 +568,20 @@ class MultiHumanRL(CADRL):
             state_tensor = self.rotate(state_tensor)
         return state_tensor
 
+    def transform_batch(self, states):
+        """
+        Take recorded states and transform them to the input of value network in one batch
+
+        :param states: array of shape (batch_size, # of humans + 1, 9), the first agent is the robot
+        :return: tensor of shape (batch_size, # of humans, self.input_dim())
+        """
+        state_tensor = super().transform_batch(states)
+        if self.with_om:
+            occupancy_maps = torch.stack([self.build_occupancy_maps([ObservableState(*human[:5])
+                                                                     for human in state[1:]]) for state in states])
+            state_tensor = torch.cat([state_tensor, occupancy_maps.to(self.device)], dim=2)
+        return state_tensor
+
     def input_dim(self):
         return self.joint_state_dim + (self.cell_num ** 2 * self.om_channel_size if self.with_om else 0)
 
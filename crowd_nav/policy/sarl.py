@@ -24,6 +24,8 @@ class ValueNetwork(nn.Module):
         mlp3_input_dim = mlp2_dims[-1] + self.self_state_dim
         self.mlp3 = mlp(mlp3_input_dim, mlp3_dims)
         self.attention_weights = None
+        # attention weights can't be kept when the network is vectorized over stacked weights
+        self.keep_attention_weights = True
 
     def forward(self, state):
         """
@@ -51,7 +53,9 @@ class ValueNetwork(nn.Module):
         # weights = softmax(scores, dim=1).unsqueeze(2)
         scores_exp = torch.exp(scores) * (scores != 0).float()
         weights = (scores_exp / torch.sum(scores_exp, dim=1, keepdim=True)).unsqueeze(2)
-        self.attention_weights = weights[0, :, 0].data.cpu().numpy()
+        if self.keep_attention_weights:
+            # one row per batch element, the policy picks the row of the chosen action
+            self.attention_weights = weights[:, :, 0].data.cpu().numpy()
 
         # output feature is a linear combination of input features
         features = mlp2_output.view(size[0], size[1], -1)
@@ -86,4 +90,7 @@ class SARL(MultiHumanRL):
         logging.info('Policy: {} {} global state'.format(self.name, 'w/' if with_global_state else 'w/o'))
 
     def get_attention_weights(self):
-        return self.model.attention_weights
+        """
+        :return: attention weights of the next state of the chosen action, kept from the batched lookahead
+        """
+        return self.attention_weights
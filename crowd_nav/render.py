@@ -0,0 +1,64 @@
+import os
+import time
+import logging
+import argparse
+from multiprocessing import Pool
+import numpy as np
+from crowd_nav.utils.episode_store import EpisodeStore, OUTCOMES
+from crowd_nav.utils.renderer import render_job
+
+
+def main():
+    parser = argparse.ArgumentParser('Render stored episodes in parallel')
+    parser.add_argument('store_dir', type=str)
+    parser.add_argument('--output_dir', type=str, default=None)
+    parser.add_argument('--test_case', type=int, nargs='+', default=None)
+    parser.add_argument('--failures', default=False, action='store_true')
+    parser.add_argument('--traj', default=False, action='store_true')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--fps', type=int, default=8)
+    parser.add_argument('--ffmpeg', type=str, default='ffmpeg')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s, %(levelname)s: %(message)s',
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    store = EpisodeStore(args.store_dir)
+    output_dir = args.output_dir if args.output_dir is not None else os.path.join(args.store_dir, 'videos')
+    os.makedirs(output_dir, exist_ok=True)
+
+    if args.test_case is not None:
+        indices = [store.find(case) for case in args.test_case]
+    elif args.failures:
+        indices = np.flatnonzero(store.episodes['outcome'] != OUTCOMES.index('success')).tolist()
+    else:
+        indices = list(range(len(store)))
+    mode = 'traj' if args.traj else 'video'
+    extension = 'png' if args.traj else 'mp4'
+    jobs = []
+    for index in indices:
+        episode = store.episodes[index]
+        output_file = os.path.join(output_dir, '{}_{}_{}.{}'.format(store.meta['phase'], episode['case'],
+                                                                   OUTCOMES[episode['outcome']], extension))
+        jobs.append((args.store_dir, index, output_file, mode, args.fps, args.ffmpeg))
+    logging.info('Render %d episodes with %d workers', len(jobs), args.workers)
+
+    start = time.time()
+    total_frames = 0
+    render_time = 0
+    with Pool(args.workers) as pool:
+        for index, frames, seconds, error in pool.imap_unordered(render_job, jobs):
+            if error is not None:
+                logging.error('Failed to render case %d: %s', store.episodes[index]['case'], error)
+                continue
+            total_frames += frames
+            render_time += seconds
+            logging.debug('Rendered case %d: %d frames in %.2f seconds', store.episodes[index]['case'], frames,
+                          seconds)
+    wall_time = time.time() - start
+    logging.info('Rendered %d frames in %.2f seconds: %.1f frames/s in total, %.1f frames/s per worker',
+                 total_frames, wall_time, total_frames / wall_time if wall_time else 0,
+                 total_frames / render_time if render_time else 0)
+
+
+if __name__ == '__main__':
+    main()
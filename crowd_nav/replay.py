@@ -0,0 +1,138 @@
+import logging
+import argparse
+import configparser
+import os
+import torch
+import numpy as np
+import gym
+from crowd_nav.utils.episode_store import EpisodeStore, OUTCOMES
+from crowd_nav.policy.policy_factory import policy_factory
+from crowd_nav.policy.multi_human_rl import MultiHumanRL
+from crowd_sim.envs.utils.robot import Robot
+
+
+def evaluate_states(policy, states, batch_size):
+    """
+    Compute the state values of recorded states in batched forward passes
+
+    :param states: array of shape (# of states, # of humans + 1, 9)
+    :return: array of shape (# of states, )
+    """
+    values = []
+    with torch.no_grad():
+        for start in range(0, len(states), batch_size):
+            inputs = policy.transform_batch(states[start:start + batch_size])
+            if isinstance(policy, MultiHumanRL):
+                outputs = policy.model(inputs).squeeze(1)
+            else:
+                # CADRL takes the value with respect to the most dangerous human
+                outputs = policy.model(inputs.view(-1, inputs.shape[2])).view(inputs.shape[0], -1).min(dim=1)[0]
+            values.append(outputs.cpu().numpy())
+    return np.concatenate(values) if values else np.zeros(0, dtype=np.float32)
+
+
+def rescore(store, policy, batch_size):
+    """
+    Re-score all stored steps with the value network of policy. Episodes with the same number of humans are
+    batched together. The score of a step is its one-step lookahead value reward + gamma_bar * V(next state),
+    which is comparable to the value estimates stored at recording time.
+
+    """
+    scores = np.full(len(store.rewards), np.nan, dtype=np.float32)
+    for human_num in np.unique(store.episodes['human_num']):
+        indices = np.flatnonzero(store.episodes['human_num'] == human_num)
+        states = np.concatenate([store.episode_states(i) for i in indices])
+        state_values = evaluate_states(policy, states, batch_size)
+        position = 0
+        for i in indices:
+            episode = store.episodes[i]
+            length = episode['length']
+            values = state_values[position:position + length]
+            episode_states = states[position:position + length]
+            position += length
+            gamma_bar = np.power(policy.gamma, store.time_step * episode_states[:-1, 0, 7])
+            rewards = store.episode_steps(i, 'rewards')
+            start = episode['step_offset']
+            scores[start:start + length - 1] = rewards[:-1] + gamma_bar * values[1:]
+            # terminal state
+            scores[start + length - 1] = rewards[-1]
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser('Replay recorded episodes')
+    parser.add_argument('store_dir', type=str)
+    parser.add_argument('--policy', type=str, default=None)
+    parser.add_argument('--policy_config', type=str, default='configs/policy.config')
+    parser.add_argument('--model_dir', type=str, default=None)
+    parser.add_argument('--il', default=False, action='store_true')
+    parser.add_argument('--gpu', default=False, action='store_true')
+    parser.add_argument('--batch_size', type=int, default=10000)
+    parser.add_argument('--test_case', type=int, default=None)
+    parser.add_argument('--video_file', type=str, default=None)
+    parser.add_argument('--traj', default=False, action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s, %(levelname)s: %(message)s',
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    device = torch.device("cuda:0" if torch.cuda.is_available() and args.gpu else "cpu")
+    store = EpisodeStore(args.store_dir)
+    logging.info('Load %d %s episodes with %d steps', len(store), store.meta['phase'], len(store.rewards))
+
+    if args.policy is not None:
+        # re-score stored episodes with the checkpoint in model_dir
+        policy = policy_factory[args.policy]()
+        if not policy.trainable:
+            parser.error('Policy has to be trainable to re-score episodes')
+        if args.model_dir is None:
+            parser.error('Trainable policy must be specified with a model weights directory')
+        policy_config_file = os.path.join(args.model_dir, os.path.basename(args.policy_config))
+        if args.il:
+            model_weights = os.path.join(args.model_dir, 'il_model.pth')
+        elif os.path.exists(os.path.join(args.model_dir, 'resumed_rl_model.pth')):
+            model_weights = os.path.join(args.model_dir, 'resumed_rl_model.pth')
+        else:
+            model_weights = os.path.join(args.model_dir, 'rl_model.pth')
+        policy_config = configparser.RawConfigParser()
+        policy_config.read(policy_config_file)
+        policy.configure(policy_config)
+        policy.get_model().load_state_dict(torch.load(model_weights))
+        policy.set_device(device)
+        policy.get_model().eval()
+
+        scores = rescore(store, policy, args.batch_size)
+        score_file = os.path.join(args.store_dir, 'scores_{}.npy'.format(os.path.basename(
+            os.path.normpath(args.model_dir))))
+        np.save(score_file, scores)
+        logging.info('Scores are saved in %s', score_file)
+
+        valid = ~np.isnan(store.values)
+        if valid.any():
+            logging.info('Mean absolute difference to stored value estimates: %.4f',
+                         np.mean(np.abs(scores[valid] - store.values[valid])))
+        initial_scores = scores[store.episodes['step_offset']]
+        for i, outcome in enumerate(OUTCOMES):
+            mask = store.episodes['outcome'] == i
+            if mask.any():
+                logging.info('%-9s episodes: %d, average initial value: %.4f', outcome, mask.sum(),
+                             initial_scores[mask].mean())
+
+    if args.test_case is not None:
+        # render a stored episode without re-simulating it
+        env_config = configparser.RawConfigParser()
+        env_config.read(store.env_config_file)
+        env = gym.make('CrowdSim-v0')
+        env.configure(env_config)
+        robot = Robot(env_config, 'robot')
+        robot.kinematics = store.meta['kinematics']
+        env.set_robot(robot)
+        index = store.find(args.test_case)
+        env.recorder.load(store.episode_states(index))
+        if args.traj:
+            env.render('traj', args.video_file)
+        else:
+            env.render('video', args.video_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,15 @@ import os
 import torch
 import numpy as np
 import gym
-from crowd_nav.utils.explorer import Explorer
+from crowd_nav.utils.explorer import Explorer, average
+from crowd_nav.utils.episode_store import EpisodeStoreWriter
+from crowd_nav.utils.eval_cache import EvaluationCache, cacheable
+from crowd_nav.utils.profiling import PROFILE_MODES, Profiler
 from crowd_nav.policy.policy_factory import policy_factory
 from crowd_sim.envs.utils.robot import Robot
+from crowd_sim.envs.utils import timing
 from crowd_sim.envs.policy.orca import ORCA
+from crowd_sim.envs.utils.info import ReachGoal
 
 
 def main():
@@ -26,6 +31,15 @@ def main():
     parser.add_argument('--circle', default=False, action='store_true')
     parser.add_argument('--video_file', type=str, default=None)
     parser.add_argument('--traj', default=False, action='store_true')
+    parser.add_argument('--store_dir', type=str, default=None)
+    parser.add_argument('--human_times', default=False, action='store_true')
+    parser.add_argument('--no_eval_cache', default=False, action='store_true')
+    parser.add_argument('--timing', default=False, action='store_true',
+                        help='time hot paths and report them at the end, disables the evaluation cache')
+    parser.add_argument('--profile', type=str, default=None, choices=PROFILE_MODES,
+                        help='profile the first episodes into <model_dir>/profile, disables the evaluation cache')
+    parser.add_argument('--profile_episodes', type=int, default=None,
+                        help='number of profiled episodes, all test cases by default')
     args = parser.parse_args()
 
     if args.model_dir is not None:
@@ -47,6 +61,8 @@ def main():
                         datefmt="%Y-%m-%d %H:%M:%S")
     device = torch.device("cuda:0" if torch.cuda.is_available() and args.gpu else "cpu")
     logging.info('Using device: %s', device)
+    if args.timing:
+        timing.enable()
 
     # configure policy
     policy = policy_factory[args.policy]()
@@ -100,11 +116,32 @@ def main():
             env.render('video', args.video_file)
 
         logging.info('It takes %.2f seconds to finish. Final status is %s', env.global_time, info)
-        if robot.visible and info == 'reach goal':
-            human_times = env.get_human_times()
-            logging.info('Average time for humans to reach goal: %.2f', sum(human_times) / len(human_times))
+        if robot.visible and isinstance(info, ReachGoal):
+            human_times = [t for t in env.get_human_times() if t != 0]
+            logging.info('Average time for humans to reach goal: %.2f', average(human_times))
     else:
-        explorer.run_k_episodes(env.case_size[args.phase], args.phase, print_failure=True)
+        episode_store = None if args.store_dir is None else EpisodeStoreWriter(args.store_dir, env, args.phase)
+        # results of unchanged models are cached in the model directory
+        eval_cache = None
+        if args.model_dir is not None and not args.no_eval_cache and not args.timing and not args.profile \
+                and cacheable(policy):
+            eval_cache = EvaluationCache(os.path.join(args.model_dir, 'eval_cache'), env_config, policy_config)
+        k = env.case_size[args.phase]
+        if args.profile is None:
+            explorer.run_k_episodes(k, args.phase, print_failure=True, episode_store=episode_store,
+                                    human_times=args.human_times, eval_cache=eval_cache)
+        else:
+            if args.profile_episodes is not None:
+                k = min(k, args.profile_episodes)
+            profiler = Profiler(args.profile, os.path.join(args.model_dir or '.', 'profile'), args.phase, 1)
+            with profiler.profile(args.phase):
+                explorer.run_k_episodes(k, args.phase, print_failure=True, episode_store=episode_store,
+                                        human_times=args.human_times)
+            profiler.close()
+        timing.report(args.phase)
+        if episode_store is not None:
+            episode_store.close()
+            logging.info('Episodes are stored in %s', args.store_dir)
 
 
 if __name__ == '__main__':
@@ -4,16 +4,41 @@ import argparse
 import configparser
 import os
 import shutil
+import contextlib
 import torch
 import gym
-import git
 from crowd_sim.envs.utils.robot import Robot
+from crowd_sim.envs.utils import timing
 from crowd_nav.utils.trainer import Trainer
-from crowd_nav.utils.memory import ReplayMemory
+from crowd_nav.utils.memory import ReplayMemory, PrioritizedReplayMemory
 from crowd_nav.utils.explorer import Explorer
+from crowd_nav.utils.eval_cache import EvaluationCache, cacheable
+from crowd_nav.utils.demonstrations import get_demonstrations, load_demonstrations
+from crowd_nav.utils.checkpoint import save_checkpoint, load_checkpoint
+from crowd_nav.utils.metrics import MetricsWriter
+from crowd_nav.utils.profiling import PROFILE_MODES, Profiler
+from crowd_nav.utils.memory_monitor import MemoryMonitor
 from crowd_nav.policy.policy_factory import policy_factory
 
 
+def log_git_head():
+    """
+    Record which code the model is trained with, git is only imported here because importing it is slow
+    """
+    try:
+        import git
+    except ImportError as e:
+        # GitPython raises an ImportError if the git executable is missing
+        logging.warning('Git head hash code is not available: %s', e)
+        return
+    try:
+        repo = git.Repo(search_parent_directories=True)
+        logging.info('Current git head hash code: %s', repo.head.object.hexsha)
+    except (git.exc.InvalidGitRepositoryError, git.exc.GitError, ValueError) as e:
+        # ValueError is raised for a repository without commits
+        logging.warning('Git head hash code is not available: %s', e)
+
+
 def main():
     parser = argparse.ArgumentParser('Parse configuration file')
     parser.add_argument('--env_config', type=str, default='configs/env.config')
@@ -25,6 +50,20 @@ def main():
     parser.add_argument('--resume', default=False, action='store_true')
     parser.add_argument('--gpu', default=False, action='store_true')
     parser.add_argument('--debug', default=False, action='store_true')
+    parser.add_argument('--no_eval_cache', default=False, action='store_true')
+    parser.add_argument('--timing', default=False, action='store_true',
+                        help='time hot paths and report them at every evaluation, disables the evaluation cache')
+    parser.add_argument('--profile', type=str, default=None, choices=PROFILE_MODES,
+                        help='profile one phase of training into <output_dir>/profile, disables the evaluation cache')
+    parser.add_argument('--profile_phase', type=str, default='rl', choices=['il', 'rl', 'train', 'val'],
+                        help='imitation learning, RL sampling, training batches or validation')
+    parser.add_argument('--profile_count', type=int, default=10, help='number of profiled runs of the phase')
+    parser.add_argument('--memory_interval', type=int, default=None,
+                        help='measure the memory of the process every this many episodes')
+    parser.add_argument('--memory_threshold', type=float, default=100,
+                        help='warn when memory grows by more KB per episode than this')
+    parser.add_argument('--memory_trace', default=False, action='store_true',
+                        help='log the allocation sites that grew most between measurements')
     args = parser.parse_args()
 
     # configure paths
@@ -46,6 +85,9 @@ def main():
     log_file = os.path.join(args.output_dir, 'output.log')
     il_weight_file = os.path.join(args.output_dir, 'il_model.pth')
     rl_weight_file = os.path.join(args.output_dir, 'rl_model.pth')
+    checkpoint_dir = os.path.join(args.output_dir, 'checkpoint')
+    # the complete training state is restored if it was checkpointed, otherwise only the RL weights
+    resume_checkpoint = args.resume and os.path.exists(os.path.join(checkpoint_dir, 'training.pth'))
 
     # configure logging
     mode = 'a' if args.resume else 'w'
@@ -54,10 +96,14 @@ def main():
     level = logging.INFO if not args.debug else logging.DEBUG
     logging.basicConfig(level=level, handlers=[stdout_handler, file_handler],
                         format='%(asctime)s, %(levelname)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-    repo = git.Repo(search_parent_directories=True)
-    logging.info('Current git head hash code: %s'.format(repo.head.object.hexsha))
+    log_git_head()
     device = torch.device("cuda:0" if torch.cuda.is_available() and args.gpu else "cpu")
     logging.info('Using device: %s', device)
+    if args.timing:
+        timing.enable()
+    profiler = None if args.profile is None else \
+        Profiler(args.profile, os.path.join(args.output_dir, 'profile'), args.profile_phase, args.profile_count)
+    profile = profiler.profile if profiler is not None else lambda phase: contextlib.nullcontext()
 
     # configure policy
     policy = policy_factory[args.policy]()
@@ -94,16 +140,33 @@ def main():
     epsilon_end = train_config.getfloat('train', 'epsilon_end')
     epsilon_decay = train_config.getfloat('train', 'epsilon_decay')
     checkpoint_interval = train_config.getint('train', 'checkpoint_interval')
+    prioritized_replay = train_config.getboolean('train', 'prioritized_replay', fallback=False)
+    priority_alpha = train_config.getfloat('train', 'priority_alpha', fallback=0.6)
+    priority_beta = train_config.getfloat('train', 'priority_beta', fallback=0.4)
+    lazy_targets = train_config.getboolean('train', 'lazy_targets', fallback=False)
 
     # configure trainer and explorer
-    memory = ReplayMemory(capacity)
+    if prioritized_replay:
+        memory = PrioritizedReplayMemory(capacity, priority_alpha, priority_beta)
+    else:
+        memory = ReplayMemory(capacity)
     model = policy.get_model()
     batch_size = train_config.getint('trainer', 'batch_size')
-    trainer = Trainer(model, memory, device, batch_size)
-    explorer = Explorer(env, robot, device, memory, policy.gamma, target_policy=policy)
+    # training metrics are appended to a binary stream next to the log, also when training is resumed
+    metrics = MetricsWriter(os.path.join(args.output_dir, 'metrics'))
+    trainer = Trainer(model, memory, device, batch_size, metrics=metrics)
+    explorer = Explorer(env, robot, device, memory, policy.gamma, target_policy=policy, lazy_targets=lazy_targets,
+                        metrics=metrics)
+    monitor = None if args.memory_interval is None else \
+        MemoryMonitor(args.memory_interval, args.memory_threshold * 1024, args.memory_trace,
+                      metrics_dir=metrics.metrics_dir)
+    eval_cache = None if args.no_eval_cache or args.timing or args.profile or not cacheable(policy) else \
+        EvaluationCache(os.path.join(args.output_dir, 'eval_cache'), env_config, policy_config)
 
     # imitation learning
-    if args.resume:
+    if resume_checkpoint:
+        logging.info('Resume from the training checkpoint')
+    elif args.resume:
         if not os.path.exists(rl_weight_file):
             logging.error('RL weights does not exist')
         model.load_state_dict(torch.load(rl_weight_file))
@@ -122,30 +185,40 @@ def main():
             safety_space = 0
         else:
             safety_space = train_config.getfloat('imitation_learning', 'safety_space')
-        il_policy = policy_factory[il_policy]()
-        il_policy.multiagent_training = policy.multiagent_training
-        il_policy.safety_space = safety_space
-        robot.set_policy(il_policy)
-        explorer.run_k_episodes(il_episodes, 'train', update_memory=True, imitation_learning=True)
-        trainer.optimize_epoch(il_epochs)
+        demonstration_dir = train_config.get('imitation_learning', 'demonstration_dir', fallback='data/demonstrations')
+        demonstration_workers = train_config.getint('imitation_learning', 'demonstration_workers',
+                                                    fallback=os.cpu_count())
+        robot.set_policy(policy_factory[il_policy]())
+        with profile('il'):
+            demonstrations = get_demonstrations(demonstration_dir, env, env_config, il_policy, safety_space,
+                                                policy.multiagent_training, il_episodes, demonstration_workers)
+            load_demonstrations(explorer, demonstrations, il_episodes)
+            # RL continues with the train cases after the demonstrations
+            env.case_counter['train'] = il_episodes
+            trainer.optimize_epoch(il_epochs)
         torch.save(model.state_dict(), il_weight_file)
         logging.info('Finish imitation learning. Weights saved.')
+        timing.report('il', metrics_dir=metrics.metrics_dir)
         logging.info('Experience set size: %d/%d', len(memory), memory.capacity)
     explorer.update_target_model(model)
+    trainer.set_target_model(explorer.target_model)
 
     # reinforcement learning
     policy.set_env(env)
     robot.set_policy(policy)
     robot.print_info()
     trainer.set_learning_rate(rl_learning_rate)
-    # fill the memory pool with some RL experience
-    if args.resume:
+    episode = 0
+    if resume_checkpoint:
+        episode = load_checkpoint(checkpoint_dir, model, explorer.target_model, trainer.optimizer, memory, env,
+                                  device)
+    elif args.resume:
+        # fill the memory pool with some RL experience
         robot.policy.set_epsilon(epsilon_end)
         explorer.run_k_episodes(100, 'train', update_memory=True, episode=0)
         logging.info('Experience set size: %d/%d', len(memory), memory.capacity)
-    episode = 0
     while episode < train_episodes:
-        if args.resume:
+        if args.resume and not resume_checkpoint:
             epsilon = epsilon_end
         else:
             if episode < epsilon_decay:
@@ -153,24 +226,42 @@ def main():
             else:
                 epsilon = epsilon_end
         robot.policy.set_epsilon(epsilon)
+        if prioritized_replay:
+            # the bias of prioritized sampling is fully corrected by the end of training
+            memory.beta = priority_beta + (1 - priority_beta) * episode / train_episodes
 
         # evaluate the model
         if episode % evaluation_interval == 0:
-            explorer.run_k_episodes(env.case_size['val'], 'val', episode=episode)
+            timing.report('train', episode, metrics.metrics_dir)
+            with profile('val'):
+                explorer.run_k_episodes(env.case_size['val'], 'val', episode=episode, eval_cache=eval_cache)
+            timing.report('val', episode, metrics.metrics_dir)
 
         # sample k episodes into memory and optimize over the generated memory
-        explorer.run_k_episodes(sample_episodes, 'train', update_memory=True, episode=episode)
-        trainer.optimize_batch(train_batches)
+        with profile('rl'):
+            explorer.run_k_episodes(sample_episodes, 'train', update_memory=True, episode=episode)
+        with profile('train'):
+            trainer.optimize_batch(train_batches)
         episode += 1
+        if monitor is not None:
+            monitor.check(episode, memory, env)
 
         if episode % target_update_interval == 0:
             explorer.update_target_model(model)
+            trainer.set_target_model(explorer.target_model)
 
         if episode != 0 and episode % checkpoint_interval == 0:
             torch.save(model.state_dict(), rl_weight_file)
+            save_checkpoint(checkpoint_dir, episode, model, explorer.target_model, trainer.optimizer, memory, env)
+            metrics.flush()
 
     # final test
-    explorer.run_k_episodes(env.case_size['test'], 'test', episode=episode)
+    timing.report('train', episode, metrics.metrics_dir)
+    explorer.run_k_episodes(env.case_size['test'], 'test', episode=episode, eval_cache=eval_cache)
+    timing.report('test', episode, metrics.metrics_dir)
+    metrics.close()
+    if profiler is not None:
+        profiler.close()
 
 
 if __name__ == '__main__':
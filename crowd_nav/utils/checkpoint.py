@@ -0,0 +1,61 @@
+import os
+import glob
+import random
+import logging
+import numpy as np
+import torch
+
+
+def save_checkpoint(checkpoint_dir, episode, model, target_model, optimizer, memory, env):
+    """
+    Save the complete training state. The replay memory alternates between two sets of fixed-size memory-mapped
+    files, a checkpoint writes the set that the current state file doesn't reference and then replaces the state
+    file atomically. Only the experiences pushed since the last save to a set are written. An interrupted checkpoint
+    leaves the previous state file and its files intact.
+
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    # the last save or load of the memory is the set of the current state file
+    memory_path = os.path.join(checkpoint_dir, 'memory_a')
+    if memory.saved_path == memory_path:
+        memory_path = os.path.join(checkpoint_dir, 'memory_b')
+    fields = memory.save(memory_path)
+    state = {'episode': episode, 'model': model.state_dict(), 'target_model': target_model.state_dict(),
+             'optimizer': optimizer.state_dict(), 'memory': os.path.basename(memory_path),
+             'memory_fields': fields, 'memory_position': memory.position, 'memory_size': len(memory),
+             'case_counter': dict(env.case_counter),
+             'random_state': random.getstate(), 'numpy_random_state': np.random.get_state(),
+             'torch_random_state': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda_random_state'] = torch.cuda.get_rng_state_all()
+    state_file = os.path.join(checkpoint_dir, 'training.pth')
+    torch.save(state, state_file + '.tmp')
+    os.replace(state_file + '.tmp', state_file)
+
+    # files of older checkpoints, which wrote the memory to a single set of files
+    for memory_file in glob.glob(os.path.join(checkpoint_dir, 'memory_*.npy')):
+        if not os.path.basename(memory_file).startswith(('memory_a_', 'memory_b_')):
+            os.remove(memory_file)
+    logging.info('Save training checkpoint of episode %d with %d experiences', episode, len(memory))
+
+
+def load_checkpoint(checkpoint_dir, model, target_model, optimizer, memory, env, device):
+    """
+    Restore the training state saved by save_checkpoint()
+
+    :return: the episode to continue with
+    """
+    state = torch.load(os.path.join(checkpoint_dir, 'training.pth'), map_location=device, weights_only=False)
+    model.load_state_dict(state['model'])
+    target_model.load_state_dict(state['target_model'])
+    optimizer.load_state_dict(state['optimizer'])
+    memory.load(os.path.join(checkpoint_dir, state['memory']), state['memory_fields'], state['memory_position'],
+                device, state.get('memory_size'))
+    env.case_counter.update(state['case_counter'])
+    random.setstate(state['random_state'])
+    np.random.set_state(state['numpy_random_state'])
+    torch.set_rng_state(state['torch_random_state'])
+    if 'cuda_random_state' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda_random_state'])
+    logging.info('Resume training from episode %d with %d experiences', state['episode'], len(memory))
+    return state['episode']
@@ -0,0 +1,140 @@
+import os
+import time
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+import configparser
+from multiprocessing import Pool
+import numpy as np
+import gym
+from crowd_sim.envs.utils.robot import Robot
+from crowd_sim.envs.utils.state import FullState, ObservableState, JointState
+from crowd_sim.envs.utils.info import ReachGoal, Collision
+from crowd_nav.policy.policy_factory import policy_factory
+from crowd_nav.utils.episode_store import EpisodeStore, EpisodeStoreWriter, OUTCOMES
+from crowd_nav.utils.eval_cache import config_text
+
+
+def demonstration_dir(root_dir, env_config, il_policy, safety_space, multiagent_training):
+    """
+    Demonstrations don't depend on the learner, so they are keyed only by what determines the demonstrator's episodes
+
+    """
+    sha = hashlib.sha256()
+    sha.update(config_text(env_config).encode())
+    sha.update(json.dumps({'il_policy': il_policy, 'safety_space': safety_space,
+                           'multiagent_training': multiagent_training}, sort_keys=True).encode())
+    return os.path.join(root_dir, sha.hexdigest()[:16])
+
+
+def demonstration_job(job):
+    """
+    Simulate a range of train cases with the demonstrator in a worker process
+
+    :param job: tuple of (env config text, demonstrator policy name, safety space, multiagent training, cases)
+    :return: list of (case, states, actions, rewards, outcome, navigation time) per episode
+    """
+    env_config_text, il_policy, safety_space, multiagent_training, cases = job
+    env_config = configparser.RawConfigParser()
+    env_config.read_string(env_config_text)
+    env = gym.make('CrowdSim-v0')
+    env.configure(env_config)
+    env.train_record_mode = 'array'
+    # demonstrations are used however long they take to reach the goal
+    env.stall_detection = False
+    robot = Robot(env_config, 'robot')
+    policy = policy_factory[il_policy]()
+    policy.multiagent_training = multiagent_training
+    policy.safety_space = safety_space
+    robot.set_policy(policy)
+    env.set_robot(robot)
+
+    episodes = []
+    for case in cases:
+        env.case_counter['train'] = case
+        ob = env.reset('train')
+        done = False
+        actions = []
+        rewards = []
+        while not done:
+            action = robot.act(ob)
+            ob, reward, done, info = env.step(action)
+            actions.append(action)
+            rewards.append(reward)
+        outcome = 'success' if isinstance(info, ReachGoal) else 'collision' if isinstance(info, Collision) \
+            else 'timeout'
+        episodes.append((case, env.recorder.states.copy(), actions, rewards, outcome, env.global_time))
+    return episodes
+
+
+def generate_demonstrations(store_dir, env, env_config, il_policy, safety_space, multiagent_training, episodes,
+                            workers, chunk_size=50):
+    """
+    Simulate the first train cases with the demonstrator in parallel and write them to an episode store. The store
+    is written to a temporary directory next to store_dir and then replaces it, so that a store that is already
+    memory-mapped is never truncated.
+
+    """
+    start = time.time()
+    jobs = [(config_text(env_config), il_policy, safety_space, multiagent_training,
+             list(range(chunk_start, min(chunk_start + chunk_size, episodes))))
+            for chunk_start in range(0, episodes, chunk_size)]
+    parent_dir, name = os.path.split(store_dir)
+    temp_dir = tempfile.mkdtemp(prefix=name + '.', dir=parent_dir)
+    try:
+        writer = EpisodeStoreWriter(temp_dir, env, 'train')
+        with Pool(workers) as pool:
+            for results in pool.imap(demonstration_job, jobs):
+                for case, states, actions, rewards, outcome, nav_time in results:
+                    writer.append(case, states, actions, rewards, [np.nan] * len(rewards), outcome, nav_time)
+        writer.close()
+        # a directory can't replace a non-empty one, so the old store is moved away first
+        if os.path.exists(store_dir):
+            os.replace(store_dir, temp_dir + '.old')
+        os.replace(temp_dir, store_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        shutil.rmtree(temp_dir + '.old', ignore_errors=True)
+    logging.info('Generate %d demonstrations with %d workers in %.2f seconds', episodes, workers,
+                 time.time() - start)
+
+
+def load_demonstrations(explorer, store, episodes):
+    """
+    Transform the first stored demonstrations for the target policy of explorer and push them into its memory.
+    Only successful and collision episodes are used, same as in Explorer.run_k_episodes().
+
+    """
+    # the robot hasn't been reset yet, but its time step is needed to discount rewards
+    explorer.robot.time_step = store.time_step
+    for index in range(episodes):
+        if store.episodes[index]['outcome'] == OUTCOMES.index('timeout'):
+            continue
+        states = []
+        for agent_states in np.asarray(store.episode_states(index), dtype=float):
+            states.append(JointState(FullState(*agent_states[0]),
+                                     [ObservableState(*human_state[:5]) for human_state in agent_states[1:]]))
+        explorer.update_memory(states, None, store.episode_steps(index, 'rewards').tolist(), imitation_learning=True)
+
+
+def get_demonstrations(root_dir, env, env_config, il_policy, safety_space, multiagent_training, episodes, workers):
+    """
+    Load the demonstrations for the env config and safety space, they are only generated if they don't exist yet.
+    Runs that share the demonstrations are serialized by a lock file, the ones waiting for the lock load the
+    demonstrations generated by the run holding it.
+
+    :return: EpisodeStore of at least the given number of episodes
+    """
+    store_dir = demonstration_dir(root_dir, env_config, il_policy, safety_space, multiagent_training)
+    os.makedirs(root_dir, exist_ok=True)
+    with open(store_dir + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.exists(os.path.join(store_dir, 'meta.json')) and len(EpisodeStore(store_dir)) >= episodes:
+            logging.info('Load demonstrations from %s', store_dir)
+        else:
+            generate_demonstrations(store_dir, env, env_config, il_policy, safety_space, multiagent_training,
+                                    episodes, workers)
+        return EpisodeStore(store_dir)
@@ -0,0 +1,52 @@
+import copy
+import logging
+import torch
+
+
+class ModelEnsemble(object):
+    def __init__(self, model, state_dicts):
+        """
+        Evaluate several weights of the same value network together. The parameters are stacked and the functional
+        network is vectorized over them with torch.func, networks that can't be vectorized are evaluated one by one.
+
+        """
+        from torch.func import stack_module_state, functional_call, vmap
+
+        self.models = []
+        for state_dict in state_dicts:
+            member = copy.deepcopy(model)
+            member.load_state_dict(state_dict)
+            self.models.append(member)
+        self.params, self.buffers = stack_module_state(self.models)
+        base = copy.deepcopy(model).to('meta')
+        if hasattr(base, 'keep_attention_weights'):
+            base.keep_attention_weights = False
+
+        def call(params, buffers, inputs):
+            return functional_call(base, (params, buffers), (inputs,))
+
+        self.batched_call = vmap(call, in_dims=(0, 0, None))
+        self.vectorized = True
+
+    def __len__(self):
+        return len(self.models)
+
+    def __call__(self, inputs, members=None):
+        """
+        :param inputs: input tensor shared by all models
+        :param members: indices of the models to evaluate, all models by default
+        :return: tensor of shape (# of models, batch_size)
+        """
+        if members is None:
+            members = list(range(len(self.models)))
+        with torch.no_grad():
+            if self.vectorized:
+                index = torch.tensor(members)
+                try:
+                    return self.batched_call({name: param[index] for name, param in self.params.items()},
+                                             {name: buffer[index] for name, buffer in self.buffers.items()},
+                                             inputs).squeeze(2)
+                except RuntimeError as e:
+                    logging.info('Evaluate models one by one, because they can not be vectorized: %s', e)
+                    self.vectorized = False
+            return torch.stack([self.models[i](inputs) for i in members]).squeeze(2)
@@ -0,0 +1,109 @@
+import os
+import json
+import numpy as np
+from crowd_sim.envs.utils.recorder import STATE_FIELDS
+
+OUTCOMES = ('success', 'collision', 'timeout')
+EPISODE_DTYPE = np.dtype([('case', np.int64), ('human_num', np.int32), ('length', np.int32), ('outcome', np.int8),
+                          ('nav_time', np.float32), ('step_offset', np.int64), ('state_offset', np.int64)])
+# per-step columns, each one is a flat binary file concatenated over all episodes
+STEP_COLUMNS = {'actions': (np.float32, (2,)), 'rewards': (np.float32, ()), 'values': (np.float32, ())}
+
+
+class EpisodeStoreWriter(object):
+    def __init__(self, store_dir, env, phase):
+        """
+        Write whole evaluation runs to a columnar episode store that can be memory-mapped by EpisodeStore.
+
+        Agent states of all episodes are appended to one (rows, 9) float32 file, where an episode of T steps and
+        H humans occupies T * (H + 1) rows. Actions, rewards and value estimates are one row per step.
+
+        """
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        with open(os.path.join(store_dir, 'env.config'), 'w') as fo:
+            env.config.write(fo)
+        self.meta = {'phase': phase, 'time_step': env.time_step, 'kinematics': env.robot.kinematics}
+        self.episodes = []
+        self.step_count = 0
+        self.state_count = 0
+        self.files = {name: open(os.path.join(store_dir, name + '.bin'), 'wb')
+                      for name in ['states'] + list(STEP_COLUMNS)}
+
+    def append(self, case, states, actions, rewards, values, outcome, nav_time):
+        """
+        :param states: recorded states of shape (steps, # humans + 1, 9)
+        :param actions: list of ActionXY or ActionRot
+        :param values: value estimate of the chosen action per step, nan if the policy has no value
+        :param outcome: one of OUTCOMES
+        """
+        length, agent_num = states.shape[:2]
+        assert len(actions) == len(rewards) == len(values) == length
+        self.episodes.append((case, agent_num - 1, length, OUTCOMES.index(outcome), nav_time, self.step_count,
+                              self.state_count))
+        self.files['states'].write(np.ascontiguousarray(states, dtype=np.float32).tobytes())
+        self.files['actions'].write(np.array(actions, dtype=np.float32).tobytes())
+        self.files['rewards'].write(np.array(rewards, dtype=np.float32).tobytes())
+        self.files['values'].write(np.array(values, dtype=np.float32).tobytes())
+        self.step_count += length
+        self.state_count += length * agent_num
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        np.save(os.path.join(self.store_dir, 'episodes.npy'), np.array(self.episodes, dtype=EPISODE_DTYPE))
+        self.meta.update({'steps': self.step_count, 'states': self.state_count, 'state_fields': STATE_FIELDS})
+        with open(os.path.join(self.store_dir, 'meta.json'), 'w') as fo:
+            json.dump(self.meta, fo, indent=2)
+
+
+class EpisodeStore(object):
+    def __init__(self, store_dir):
+        """
+        Read-only view of an episode store, all columns are memory-mapped
+
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as fo:
+            self.meta = json.load(fo)
+        self.episodes = np.load(os.path.join(store_dir, 'episodes.npy'))
+        self.states = self._map('states', np.float32, (self.meta['states'], len(STATE_FIELDS)))
+        self.actions = self._map_steps('actions')
+        self.rewards = self._map_steps('rewards')
+        self.values = self._map_steps('values')
+
+    def _map_steps(self, name):
+        dtype, shape = STEP_COLUMNS[name]
+        return self._map(name, dtype, (self.meta['steps'],) + shape)
+
+    def _map(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.store_dir, name + '.bin'), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    @property
+    def time_step(self):
+        return self.meta['time_step']
+
+    @property
+    def env_config_file(self):
+        return os.path.join(self.store_dir, 'env.config')
+
+    def find(self, case):
+        indices = np.flatnonzero(self.episodes['case'] == case)
+        if len(indices) == 0:
+            raise KeyError('Case {} is not in the episode store'.format(case))
+        return indices[0]
+
+    def episode_states(self, index):
+        episode = self.episodes[index]
+        start = episode['state_offset']
+        end = start + episode['length'] * (episode['human_num'] + 1)
+        return self.states[start:end].reshape((episode['length'], episode['human_num'] + 1, len(STATE_FIELDS)))
+
+    def episode_steps(self, index, column):
+        episode = self.episodes[index]
+        return getattr(self, column)[episode['step_offset']:episode['step_offset'] + episode['length']]
@@ -0,0 +1,66 @@
+import os
+import io
+import json
+import hashlib
+
+
+def config_text(config):
+    output = io.StringIO()
+    config.write(output)
+    return output.getvalue()
+
+
+def cacheable(policy):
+    """
+    :return: whether the results of the policy are determined by the digest, policies that search until a time budget
+    or deadline runs out depend on the wall clock
+    """
+    return not getattr(policy, 'time_budget', None) and not getattr(policy, 'deadline', None)
+
+
+class EvaluationCache(object):
+    def __init__(self, cache_dir, env_config, policy_config):
+        """
+        Content-addressed cache of the results of val and test cases. Results are stored per digest of everything
+        that determines an episode except the case index, which is the key within a digest. Policies with a time
+        budget or deadline are not cached, see cacheable().
+
+        """
+        self.cache_dir = cache_dir
+        self.env_config = config_text(env_config)
+        self.policy_config = config_text(policy_config)
+
+    def digest(self, policy, env, phase):
+        """
+        Hash of the model weights, the configs and the simulation settings that can be changed after configuring
+
+        """
+        sha = hashlib.sha256()
+        sha.update(self.env_config.encode())
+        sha.update(self.policy_config.encode())
+        settings = {'policy': policy.__class__.__name__, 'phase': phase, 'human_num': env.human_num,
+                    'train_val_sim': env.train_val_sim, 'test_sim': env.test_sim,
+                    'safety_space': getattr(policy, 'safety_space', None)}
+        sha.update(json.dumps(settings, sort_keys=True).encode())
+        if policy.trainable:
+            for name, tensor in policy.get_model().state_dict().items():
+                sha.update(name.encode())
+                sha.update(tensor.cpu().numpy().tobytes())
+        return sha.hexdigest()
+
+    def load(self, digest):
+        """
+        :return: dict from case index to result
+        """
+        cache_file = os.path.join(self.cache_dir, digest + '.json')
+        if not os.path.exists(cache_file):
+            return dict()
+        with open(cache_file) as f:
+            return {int(case): result for case, result in json.load(f).items()}
+
+    def save(self, digest, results):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_file = os.path.join(self.cache_dir, digest + '.json')
+        with open(cache_file + '.tmp', 'w') as f:
+            json.dump({str(case): result for case, result in results.items()}, f)
+        os.replace(cache_file + '.tmp', cache_file)
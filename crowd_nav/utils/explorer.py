@@ -1,11 +1,21 @@
+import time
 import logging
 import copy
 import torch
+import numpy as np
 from crowd_sim.envs.utils.info import *
+from crowd_sim.envs.utils import timing
+from crowd_nav.utils.eval_cache import cacheable
 
 
 class Explorer(object):
-    def __init__(self, env, robot, device, memory=None, gamma=None, target_policy=None):
+    def __init__(self, env, robot, device, memory=None, gamma=None, target_policy=None, lazy_targets=False,
+                 metrics=None):
+        """
+        :param lazy_targets: store (state, reward, next state, discount) transitions and leave computing the value
+        targets to the trainer, instead of storing (state, value) with the value of the current target model
+        :param metrics: optional MetricsWriter, every episode and every call of run_k_episodes() is recorded
+        """
         self.env = env
         self.robot = robot
         self.device = device
@@ -13,63 +23,87 @@ class Explorer(object):
         self.gamma = gamma
         self.target_policy = target_policy
         self.target_model = None
+        self.lazy_targets = lazy_targets
+        self.metrics = metrics
 
     def update_target_model(self, target_model):
         self.target_model = copy.deepcopy(target_model)
 
-    # @profile
     def run_k_episodes(self, k, phase, update_memory=False, imitation_learning=False, episode=None,
-                       print_failure=False):
+                       print_failure=False, episode_store=None, human_times=False, eval_cache=None):
+        """
+        :param episode_store: optional EpisodeStoreWriter, every episode is written to it with its states,
+        actions, rewards and value estimates
+        :param human_times: fast-forward every successful episode to compute the time for humans to reach goals
+        :param eval_cache: optional EvaluationCache, cases with known results are not simulated in val and test
+        """
         self.robot.policy.set_phase(phase)
+        if episode_store is not None and self.env.get_record_mode(phase) == 'off':
+            raise ValueError('Episodes have to be recorded to be stored')
+        results = None
+        if eval_cache is not None and phase != 'train' and not update_memory and episode_store is None \
+                and not human_times and cacheable(self.robot.policy):
+            digest = eval_cache.digest(self.robot.policy, self.env, phase)
+            results = eval_cache.load(digest)
+        start = time.time()
+        steps = 0
+        # only the train phase explores
+        epsilon = getattr(self.robot.policy, 'epsilon', None)
+        epsilon = np.nan if epsilon is None or phase != 'train' else epsilon
+        cached = 0
         success_times = []
         collision_times = []
         timeout_times = []
         success = 0
         collision = 0
         timeout = 0
+        stalled = 0
         too_close = 0
         min_dist = []
         cumulative_rewards = []
         collision_cases = []
         timeout_cases = []
+        human_goal_times = []
         for i in range(k):
-            ob = self.env.reset(phase)
-            done = False
-            states = []
-            actions = []
-            rewards = []
-            while not done:
-                action = self.robot.act(ob)
-                ob, reward, done, info = self.env.step(action)
-                states.append(self.robot.policy.last_state)
-                actions.append(action)
-                rewards.append(reward)
-
-                if isinstance(info, Danger):
-                    too_close += 1
-                    min_dist.append(info.min_dist)
-
-            if isinstance(info, ReachGoal):
+            case = self.env.case_counter[phase]
+            if results is not None and case in results:
+                # the case doesn't have to be simulated, but the following cases stay the same
+                result = results[case]
+                self.env.case_counter[phase] = (case + 1) % self.env.case_size[phase]
+                cached += 1
+                if self.metrics is not None:
+                    self.metrics.episode(phase, -1 if episode is None else episode, case, result['outcome'],
+                                         result['time'], result['reward'], epsilon, cached=True)
+            else:
+                result = self.run_episode(phase, update_memory, imitation_learning, episode_store, human_times)
+                if results is not None:
+                    results[case] = result
+                if human_times:
+                    human_goal_times += result.pop('human_times')
+                steps += int(round(result['time'] / self.env.time_step))
+                if self.metrics is not None:
+                    self.metrics.episode(phase, -1 if episode is None else episode, case, result['outcome'],
+                                         result['time'], result['reward'], epsilon)
+
+            too_close += len(result['danger_dists'])
+            min_dist += result['danger_dists']
+            if result['outcome'] == 'success':
                 success += 1
-                success_times.append(self.env.global_time)
-            elif isinstance(info, Collision):
+                success_times.append(result['time'])
+            elif result['outcome'] == 'collision':
                 collision += 1
                 collision_cases.append(i)
-                collision_times.append(self.env.global_time)
-            elif isinstance(info, Timeout):
+                collision_times.append(result['time'])
+            else:
                 timeout += 1
                 timeout_cases.append(i)
                 timeout_times.append(self.env.time_limit)
-            else:
-                raise ValueError('Invalid end signal from environment')
-
-            if update_memory:
-                if isinstance(info, ReachGoal) or isinstance(info, Collision):
-                    # only add positive(success) or negative(collision) experience in experience set
-                    self.update_memory(states, actions, rewards, imitation_learning)
-
-            cumulative_rewards.append(sum([pow(self.gamma, t * self.robot.time_step * self.robot.v_pref)
-                                           * reward for t, reward in enumerate(rewards)]))
+                stalled += result.get('stalled', False)
+            cumulative_rewards.append(result['reward'])
+        if cached:
+            logging.info('Take the results of %d/%d cases from the evaluation cache', cached, k)
+        if results is not None and cached < k:
+            eval_cache.save(digest, results)
 
         success_rate = success / k
         collision_rate = collision / k
@@ -80,22 +114,111 @@ class Explorer(object):
         logging.info('{:<5} {}has success rate: {:.2f}, collision rate: {:.2f}, nav time: {:.2f}, total reward: {:.4f}'.
                      format(phase.upper(), extra_info, success_rate, collision_rate, avg_nav_time,
                             average(cumulative_rewards)))
+        if stalled:
+            logging.info('%d/%d episodes are stalled and ended early as timeouts', stalled, k)
+        danger_frequency = np.nan
         if phase in ['val', 'test']:
-            total_time = sum(success_times + collision_times + timeout_times) * self.robot.time_step
+            total_time = sum(success_times + collision_times + timeout_times) * self.env.time_step
+            danger_frequency = too_close / total_time
             logging.info('Frequency of being in danger: %.2f and average min separate distance in danger: %.2f',
-                         too_close / total_time, average(min_dist))
+                         danger_frequency, average(min_dist))
+        if self.metrics is not None:
+            self.metrics.evaluation(phase, -1 if episode is None else episode, k, success_rate, collision_rate,
+                                    timeout / k, avg_nav_time, average(cumulative_rewards), danger_frequency, epsilon,
+                                    time.time() - start, steps)
+
+        if hasattr(self.robot.policy, 'log_statistics'):
+            self.robot.policy.log_statistics()
+        if human_times:
+            logging.info('Average time for humans to reach goal: %.2f', average(human_goal_times))
 
         if print_failure:
             logging.info('Collision cases: ' + ' '.join([str(x) for x in collision_cases]))
             logging.info('Timeout cases: ' + ' '.join([str(x) for x in timeout_cases]))
 
+    def run_episode(self, phase, update_memory=False, imitation_learning=False, episode_store=None,
+                    human_times=False):
+        """
+        Simulate the next case of phase
+
+        :return: dict of the outcome, time, cumulative discounted reward and the distances of danger steps
+        """
+        case = self.env.case_counter[phase]
+        self.env.stall_detection = not imitation_learning
+        ob = self.env.reset(phase)
+        done = False
+        states = []
+        actions = []
+        rewards = []
+        values = []
+        danger_dists = []
+        while not done:
+            with timing.timer('robot.act'):
+                action = self.robot.act(ob)
+            with timing.timer('env.step'):
+                ob, reward, done, info = self.env.step(action)
+            timing.count('env.steps')
+            states.append(self.robot.policy.last_state)
+            actions.append(action)
+            rewards.append(reward)
+            if episode_store is not None:
+                action_values = getattr(self.robot.policy, 'action_values', None)
+                values.append(np.nanmax(action_values) if action_values else np.nan)
+
+            if isinstance(info, Danger):
+                danger_dists.append(info.min_dist)
+
+        if isinstance(info, ReachGoal):
+            outcome = 'success'
+        elif isinstance(info, Collision):
+            outcome = 'collision'
+        elif isinstance(info, Timeout):
+            outcome = 'timeout'
+        else:
+            raise ValueError('Invalid end signal from environment')
+        result = {'outcome': outcome, 'time': self.env.global_time, 'danger_dists': danger_dists,
+                  'stalled': isinstance(info, Stalled)}
+        if human_times:
+            result['human_times'] = [t for t in self.env.get_human_times(record=False) if t != 0] \
+                if outcome == 'success' else []
+
+        if episode_store is not None:
+            # computing human times fast-forwards the simulation, so the nav time is taken from the result
+            episode_store.append(case, self.env.recorder.states, actions, rewards, values, outcome, result['time'])
+
+        if update_memory:
+            if isinstance(info, ReachGoal) or isinstance(info, Collision):
+                # only add positive(success) or negative(collision) experience in experience set
+                with timing.timer('explorer.update_memory'):
+                    self.update_memory(states, actions, rewards, imitation_learning)
+
+        result['reward'] = sum([pow(self.gamma, t * self.robot.time_step * self.robot.v_pref)
+                                * reward for t, reward in enumerate(rewards)])
+        return result
+
     def update_memory(self, states, actions, rewards, imitation_learning=False):
         if self.memory is None or self.gamma is None:
             raise ValueError('Memory or gamma value is not set!')
 
+        gamma_bar = pow(self.gamma, self.robot.time_step * self.robot.v_pref)
         for i, state in enumerate(states):
             reward = rewards[i]
 
+            if self.lazy_targets:
+                if imitation_learning:
+                    state = self.target_policy.transform(state)
+                    # the value of the whole episode is the target, so it is stored like a terminal transition
+                    reward = sum([pow(self.gamma, max(t - i, 0) * self.robot.time_step * self.robot.v_pref) * r
+                                  for t, r in enumerate(rewards)])
+                    next_state, discount = state, 0
+                elif i == len(states) - 1:
+                    next_state, discount = state, 0
+                else:
+                    next_state, discount = states[i + 1], gamma_bar
+                self.memory.push((state, torch.Tensor([reward]).to(self.device), next_state,
+                                  torch.Tensor([discount]).to(self.device)))
+                continue
+
             # VALUE UPDATE
             if imitation_learning:
                 # define the value of states in IL as cumulative discounted rewards, which is the same in RL
@@ -109,7 +232,6 @@ class Explorer(object):
                     value = reward
                 else:
                     next_state = states[i + 1]
-                    gamma_bar = pow(self.gamma, self.robot.time_step * self.robot.v_pref)
                     value = reward + gamma_bar * self.target_model(next_state.unsqueeze(0)).data.item()
             value = torch.Tensor([value]).to(self.device)
 
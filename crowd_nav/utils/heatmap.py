@@ -0,0 +1,86 @@
+import configparser
+import numpy as np
+from crowd_nav.utils.episode_store import OUTCOMES
+
+HEATMAPS = ('occupancy', 'collision', 'discomfort')
+
+
+def step_indices(store):
+    """
+    Index the flat state rows of a store by step
+
+    :return: tuple of (row of the robot in each step, step of each state row)
+    """
+    episodes = store.episodes
+    lengths = episodes['length'].astype(np.int64)
+    agent_nums = episodes['human_num'].astype(np.int64) + 1
+    step_num = int(lengths.sum())
+    step_in_episode = np.arange(step_num) - np.repeat(episodes['step_offset'], lengths)
+    robot_rows = np.repeat(episodes['state_offset'], lengths) + step_in_episode * np.repeat(agent_nums, lengths)
+    row_steps = np.repeat(np.arange(step_num), np.repeat(agent_nums, lengths))
+    return robot_rows, row_steps
+
+
+def min_distances(store):
+    """
+    Closest distance between the boundaries of the robot and any human in every stored step
+
+    """
+    states = np.asarray(store.states)
+    robot_rows, row_steps = step_indices(store)
+    human_mask = np.ones(len(states), dtype=bool)
+    human_mask[robot_rows] = False
+    human_rows = np.flatnonzero(human_mask)
+    robots = states[robot_rows[row_steps[human_rows]]]
+    humans = states[human_rows]
+    distances = np.linalg.norm(humans[:, :2] - robots[:, :2], axis=1) - humans[:, 4] - robots[:, 4]
+    # human rows of one step are contiguous, so the minimum of each step is a segmented reduction
+    starts = np.searchsorted(row_steps[human_rows], np.arange(len(robot_rows)))
+    return np.minimum.reduceat(distances, starts) if len(distances) else np.zeros(0)
+
+
+def trajectory_histograms(store, bins=100, extent=6, discomfort_dist=None):
+    """
+    Bin the robot positions of all stored episodes into 2D histograms in one pass per heatmap
+
+    :return: dict from heatmap name to an array of shape (bins, bins), indexed as [x, y]
+    """
+    if discomfort_dist is None:
+        env_config = configparser.RawConfigParser()
+        env_config.read(store.env_config_file)
+        discomfort_dist = env_config.getfloat('reward', 'discomfort_dist')
+    states = np.asarray(store.states)
+    robot_rows, _ = step_indices(store)
+    robot_positions = states[robot_rows, :2]
+    histogram_range = [[-extent, extent], [-extent, extent]]
+
+    episodes = store.episodes
+    collision_episodes = episodes[episodes['outcome'] == OUTCOMES.index('collision')]
+    last_steps = collision_episodes['step_offset'] + collision_episodes['length'] - 1
+    discomfort_steps = min_distances(store) < discomfort_dist
+
+    positions = {'occupancy': robot_positions, 'collision': robot_positions[last_steps],
+                 'discomfort': robot_positions[discomfort_steps]}
+    return {name: np.histogram2d(positions[name][:, 0], positions[name][:, 1], bins=bins,
+                                 range=histogram_range)[0] for name in HEATMAPS}
+
+
+def plot_heatmaps(histograms, extent, title, output_file):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+
+    fig, axes = plt.subplots(1, len(HEATMAPS), figsize=(7 * len(HEATMAPS), 6))
+    for ax, name in zip(axes, HEATMAPS):
+        histogram = histograms[name]
+        norm = LogNorm(vmin=1, vmax=histogram.max()) if histogram.max() > 1 else None
+        image = ax.imshow(np.ma.masked_equal(histogram.T, 0), origin='lower', norm=norm, cmap='viridis',
+                          extent=[-extent, extent, -extent, extent])
+        ax.set_title('{} ({:d})'.format(name.capitalize(), int(histogram.sum())), fontsize=16)
+        ax.set_xlabel('x(m)', fontsize=14)
+        ax.set_ylabel('y(m)', fontsize=14)
+        fig.colorbar(image, ax=ax)
+    fig.suptitle(title, fontsize=16)
+    fig.savefig(output_file)
+    plt.close(fig)
@@ -1,3 +1,6 @@
+import os
+import numpy as np
+import torch
 from torch.utils.data import Dataset
 
 
@@ -6,8 +9,14 @@ class ReplayMemory(Dataset):
         self.capacity = capacity
         self.memory = list()
         self.position = 0
+        # items pushed in total and at the last save to each path, save() only writes the items pushed since then
+        self.pushes = 0
+        self.saved_pushes = dict()
+        # path of the last save or load
+        self.saved_path = None
 
     def push(self, item):
+        self.pushes += 1
         # replace old experience with new experience
         if len(self.memory) < self.position + 1:
             self.memory.append(item)
@@ -26,3 +35,155 @@ class ReplayMemory(Dataset):
 
     def clear(self):
         self.memory = list()
+        self.saved_pushes = dict()
+
+    def save(self, path):
+        """
+        Write every field of the items to a memory-mapped .npy file named <path>_<field>.npy with one row per slot of
+        the memory. Only the items pushed since the last save to the same path are written, the other rows are
+        kept. An interrupted save can leave rows of new items next to the old ones, so files that must not change
+        have to be saved to another path.
+
+        :return: number of fields
+        """
+        if not self.memory:
+            return 0
+        new = len(self.memory)
+        if path in self.saved_pushes:
+            new = min(self.pushes - self.saved_pushes[path], new)
+        # the slots of the last new items pushed before the current position
+        indices = (self.position - new + np.arange(new)) % self.capacity
+        chunk_size = 10000
+        for field in range(len(self.memory[0])):
+            file = '{}_{}.npy'.format(path, field)
+            shape = (self.capacity,) + tuple(self.memory[0][field].shape)
+            array = np.load(file, mmap_mode='r+') if os.path.exists(file) else None
+            field_indices = indices
+            if array is None or array.shape != shape or array.dtype != np.float32:
+                del array
+                array = np.lib.format.open_memmap(file, mode='w+', dtype=np.float32, shape=shape)
+                field_indices = np.arange(len(self.memory))
+            for start in range(0, len(field_indices), chunk_size):
+                chunk = field_indices[start:start + chunk_size]
+                array[chunk] = torch.stack([self.memory[i][field] for i in chunk]).cpu().numpy()
+            array.flush()
+            del array
+        self.saved_pushes[path] = self.pushes
+        self.saved_path = path
+        return len(self.memory[0])
+
+    def load(self, path, fields, position, device, size=None):
+        """
+        Replace the items with the first size rows written by save(), all rows by default
+
+        """
+        arrays = [np.load('{}_{}.npy'.format(path, field), mmap_mode='r')[:size] for field in range(fields)]
+        tensors = [torch.from_numpy(np.array(array)).to(device) for array in arrays]
+        self.memory = list(zip(*tensors)) if tensors else list()
+        self.position = position
+        # the files hold all items now, files at other paths are unknown
+        self.saved_pushes = {path: self.pushes}
+        self.saved_path = path
+
+
+class SumTree(object):
+    def __init__(self, capacity):
+        """
+        Array-backed binary tree whose inner nodes hold the sum of their children's priorities. Leaves are padded
+        to a power of two, so all of them have the same depth and a batch can descend the tree level by level.
+
+        """
+        self.depth = int(np.ceil(np.log2(max(capacity, 2))))
+        self.leaf_start = 2 ** self.depth - 1
+        self.nodes = np.zeros(2 ** (self.depth + 1) - 1)
+
+    def total(self):
+        return self.nodes[0]
+
+    def priorities(self, size):
+        return self.nodes[self.leaf_start:self.leaf_start + size]
+
+    def update(self, indices, priorities):
+        """
+        Set the priorities of the leaves and recompute their ancestors in O(batch size * log n)
+
+        """
+        nodes = np.asarray(indices) + self.leaf_start
+        self.nodes[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique((nodes - 1) // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes + 1] + self.nodes[2 * nodes + 2]
+
+    def find(self, values):
+        """
+        :param values: array of prefix sums in [0, total)
+        :return: array of the leaves whose priority interval contains the values
+        """
+        nodes = np.zeros(len(values), dtype=np.int64)
+        values = np.array(values, dtype=float)
+        for _ in range(self.depth):
+            left = 2 * nodes + 1
+            go_right = values >= self.nodes[left]
+            values -= np.where(go_right, self.nodes[left], 0)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.leaf_start
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    def __init__(self, capacity, alpha=0.6, beta=0.4, epsilon=1e-3):
+        """
+        Replay memory that samples items in proportion to their priority ** alpha. New items get the maximal
+        priority seen so far, so they are sampled at least once before their error is known.
+
+        :param alpha: how much prioritization is used, 0 is uniform sampling
+        :param beta: exponent of the importance-sampling weights correcting the bias, annealed to 1 during training
+        :param epsilon: added to the absolute errors so that items with a zero error are still sampled
+        """
+        super().__init__(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def push(self, item):
+        self.tree.update([self.position], self.max_priority)
+        super().push(item)
+
+    def clear(self):
+        super().clear()
+        self.position = 0
+        self.tree = SumTree(self.capacity)
+        self.max_priority = 1.0
+
+    def sample(self, batch_size):
+        """
+        Stratified sampling, one item from each of batch_size equal segments of the total priority
+
+        :return: tuple of (indices, importance-sampling weights normalized by the largest one in the batch)
+        """
+        total = self.tree.total()
+        values = (np.arange(batch_size) + np.random.random(batch_size)) * (total / batch_size)
+        # rounding in the inner nodes can lead past the last stored item
+        indices = np.minimum(self.tree.find(values), len(self.memory) - 1)
+        probabilities = self.tree.priorities(len(self.memory))[indices] / total
+        weights = np.power(len(self.memory) * probabilities, -self.beta)
+        return indices, weights / weights.max()
+
+    def update_priorities(self, indices, errors):
+        priorities = np.power(np.abs(errors) + self.epsilon, self.alpha)
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities)
+
+    def save(self, path):
+        fields = super().save(path)
+        np.save('{}_priorities.npy'.format(path), self.tree.priorities(len(self.memory)))
+        return fields
+
+    def load(self, path, fields, position, device, size=None):
+        super().load(path, fields, position, device, size)
+        self.tree = SumTree(self.capacity)
+        if self.memory:
+            priorities = np.load('{}_priorities.npy'.format(path))
+            self.tree.update(np.arange(len(priorities)), priorities)
+            self.max_priority = max(1.0, priorities.max())
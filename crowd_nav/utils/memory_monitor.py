@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import logging
+import resource
+import tracemalloc
+
+
+def rss():
+    """
+    :return: resident set size of this process in bytes, the peak size where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def replay_nbytes(memory):
+    """
+    Estimate of the tensor bytes of a replay memory from its first item, all items have the same shapes
+
+    """
+    if len(memory) == 0:
+        return 0
+    item_bytes = sum(tensor.element_size() * tensor.nelement() for tensor in memory[0])
+    tree = getattr(memory, 'tree', None)
+    return item_bytes * len(memory) + (tree.nodes.nbytes if tree is not None else 0)
+
+
+class MemoryMonitor(object):
+    def __init__(self, interval, growth_threshold, trace=False, top=10, metrics_dir=None):
+        """
+        Measure the memory of the process every interval episodes and warn when it grows by more than
+        growth_threshold bytes per episode. The replay memory grows until it is full, so its growth is not counted.
+
+        :param trace: also take tracemalloc snapshots and log the allocation sites that grew most, this slows down
+        every allocation of python objects
+        :param metrics_dir: measurements are appended to <metrics_dir>/memory.jsonl
+        """
+        self.interval = interval
+        self.growth_threshold = growth_threshold
+        self.trace = trace
+        self.top = top
+        self.metrics_dir = metrics_dir
+        self.last_episode = None
+        self.last_rss = None
+        self.last_replay = None
+        self.snapshot = None
+        if trace:
+            tracemalloc.start()
+
+    def check(self, episode, memory=None, env=None):
+        """
+        Called after every episode of training, measures every interval episodes
+
+        """
+        if self.last_episode is not None and episode - self.last_episode < self.interval:
+            return
+        current_rss = rss()
+        replay = 0 if memory is None else replay_nbytes(memory)
+        recorder = 0 if env is None or env.recorder is None else env.recorder.nbytes()
+        result = {'wall_time': time.time(), 'episode': episode, 'rss': current_rss, 'replay_memory': replay,
+                  'replay_items': 0 if memory is None else len(memory), 'recorder': recorder}
+        logging.info('Memory in episode %d: rss %.1f MB, replay memory %.1f MB in %d items, recorder %.1f MB',
+                     episode, current_rss / 2 ** 20, replay / 2 ** 20, result['replay_items'], recorder / 2 ** 20)
+
+        if self.last_episode is not None:
+            episodes = episode - self.last_episode
+            growth = (current_rss - self.last_rss - (replay - self.last_replay)) / episodes
+            result['growth_per_episode'] = growth
+            if growth > self.growth_threshold:
+                logging.warning('Memory grows by %.1f KB per episode besides the replay memory over the last %d '
+                                'episodes', growth / 1024, episodes)
+
+        if self.trace:
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            if self.snapshot is not None:
+                sites = []
+                stats = [stat for stat in snapshot.compare_to(self.snapshot, 'lineno') if stat.size_diff > 0]
+                for stat in stats[:self.top]:
+                    frame = stat.traceback[0]
+                    logging.info('Allocation growth at %s:%d: %+.1f KB in %+d blocks', frame.filename, frame.lineno,
+                                 stat.size_diff / 1024, stat.count_diff)
+                    sites.append({'file': frame.filename, 'line': frame.lineno, 'size_diff': stat.size_diff,
+                                  'count_diff': stat.count_diff})
+                result['allocation_sites'] = sites
+            self.snapshot = snapshot
+
+        if self.metrics_dir is not None:
+            with open(os.path.join(self.metrics_dir, 'memory.jsonl'), 'a') as f:
+                f.write(json.dumps(result) + '\n')
+        self.last_episode = episode
+        self.last_rss = current_rss
+        self.last_replay = replay
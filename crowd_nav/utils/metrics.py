@@ -0,0 +1,84 @@
+import os
+import time
+import numpy as np
+from crowd_nav.utils.episode_store import OUTCOMES
+
+PHASES = ('train', 'val', 'test')
+# one fixed-size record per episode, per run_k_episodes() call and per optimization call of the trainer
+RECORD_DTYPES = {
+    'episode': np.dtype([('wall_time', np.float64), ('phase', np.int8), ('episode', np.int64), ('case', np.int64),
+                         ('outcome', np.int8), ('nav_time', np.float32), ('reward', np.float32),
+                         ('epsilon', np.float32), ('cached', np.bool_)]),
+    'evaluation': np.dtype([('wall_time', np.float64), ('phase', np.int8), ('episode', np.int64),
+                            ('episodes', np.int32), ('success_rate', np.float32), ('collision_rate', np.float32),
+                            ('timeout_rate', np.float32), ('nav_time', np.float32), ('reward', np.float32),
+                            ('danger_frequency', np.float32), ('epsilon', np.float32), ('duration', np.float32),
+                            ('episodes_per_second', np.float32), ('steps_per_second', np.float32)]),
+    'optimization': np.dtype([('wall_time', np.float64), ('epochs', np.int32), ('batches', np.int32),
+                              ('loss', np.float32), ('memory_size', np.int64), ('duration', np.float32),
+                              ('batches_per_second', np.float32)]),
+}
+
+
+class MetricsWriter(object):
+    def __init__(self, metrics_dir, buffer_size=1000):
+        """
+        Append-only binary metrics stream with one <kind>.bin file of RECORD_DTYPES[kind] records per record kind.
+        Records are buffered and only whole records are written, so the files of a running training can be read at
+        any time. Episode numbers are -1 for episodes outside of the training loop.
+
+        """
+        self.metrics_dir = metrics_dir
+        self.buffer_size = buffer_size
+        self.buffers = {kind: [] for kind in RECORD_DTYPES}
+        os.makedirs(metrics_dir, exist_ok=True)
+
+    def episode(self, phase, episode, case, outcome, nav_time, reward, epsilon, cached=False):
+        self.append('episode', (time.time(), PHASES.index(phase), episode, case, OUTCOMES.index(outcome), nav_time,
+                                reward, epsilon, cached))
+
+    def evaluation(self, phase, episode, episodes, success_rate, collision_rate, timeout_rate, nav_time, reward,
+                   danger_frequency, epsilon, duration, steps):
+        self.append('evaluation', (time.time(), PHASES.index(phase), episode, episodes, success_rate, collision_rate,
+                                   timeout_rate, nav_time, reward, danger_frequency, epsilon, duration,
+                                   episodes / duration if duration else np.nan,
+                                   steps / duration if duration else np.nan))
+        # evaluations are rare, so the stream is never far behind the log
+        self.flush()
+
+    def optimization(self, epochs, batches, loss, memory_size, duration):
+        self.append('optimization', (time.time(), epochs, batches, loss, memory_size, duration,
+                                     batches / duration if duration else np.nan))
+
+    def append(self, kind, record):
+        self.buffers[kind].append(record)
+        if len(self.buffers[kind]) >= self.buffer_size:
+            self.flush(kind)
+
+    def flush(self, kind=None):
+        kinds = list(RECORD_DTYPES) if kind is None else [kind]
+        for name in kinds:
+            if not self.buffers[name]:
+                continue
+            with open(os.path.join(self.metrics_dir, name + '.bin'), 'ab') as f:
+                f.write(np.array(self.buffers[name], dtype=RECORD_DTYPES[name]).tobytes())
+            self.buffers[name] = []
+
+    def close(self):
+        self.flush()
+
+
+def load_metrics(metrics_dir, kind, offset=0):
+    """
+    Read the records of one kind with a single vectorized read
+
+    :param offset: number of records to skip, e.g. the ones read before when following a running training
+    :return: structured array of RECORD_DTYPES[kind]
+    """
+    path = os.path.join(metrics_dir, kind + '.bin')
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=RECORD_DTYPES[kind])
+    dtype = RECORD_DTYPES[kind]
+    # a record that is still being written is left for the next read
+    count = os.path.getsize(path) // dtype.itemsize - offset
+    return np.fromfile(path, dtype=dtype, count=max(count, 0), offset=offset * dtype.itemsize)
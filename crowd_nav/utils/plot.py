@@ -1,7 +1,15 @@
+import os
 import re
 import argparse
 import matplotlib.pyplot as plt
 import numpy as np
+from crowd_nav.utils.metrics import PHASES, load_metrics
+
+LOG_PATTERN = re.compile(r"(?P<phase>TRAIN|VAL  ) in episode (?P<episode>\d+) has success rate: (?P<sr>[0-1].\d+), "
+                         r"collision rate: (?P<cr>[0-1].\d+), nav time: (?P<time>\d+.\d+), "
+                         r"total reward: (?P<reward>[-+]?\d+.\d+)")
+# plotted quantities, indexed like the columns of RunReader arrays
+FIELDS = ('episode', 'sr', 'cr', 'time', 'reward')
 
 
 def running_mean(x, n):
@@ -9,9 +17,106 @@ def running_mean(x, n):
     return (cumsum[n:] - cumsum[:-n]) / float(n)
 
 
+class RunningMean(object):
+    def __init__(self, window_size):
+        """
+        Running mean over a growing series, only the last window_size - 1 values are kept to extend it
+
+        """
+        self.window_size = window_size
+        self.tail = np.zeros((0, len(FIELDS) - 1))
+        self.means = np.zeros((0, len(FIELDS)))
+
+    def extend(self, rows):
+        """
+        :param rows: array of new rows of FIELDS
+        """
+        if len(rows) == 0:
+            return
+        values = np.concatenate([self.tail, rows[:, 1:]])
+        if len(values) >= self.window_size:
+            means = np.stack([running_mean(column, self.window_size) for column in values.T], axis=1)
+            # a mean is plotted at the last episode of its window
+            episodes = rows[-len(means):, :1]
+            self.means = np.concatenate([self.means, np.concatenate([episodes, means], axis=1)])
+        self.tail = values[len(values) - self.window_size + 1:]
+
+
+class RunReader(object):
+    def __init__(self, path, window_size):
+        """
+        Follow the train and val results of a training run. The binary metrics stream of the run is read if it
+        exists, otherwise its log. Both are only read from where the last read stopped.
+
+        :param path: output directory of train.py or its log file
+        """
+        self.run_dir = path if os.path.isdir(path) else os.path.dirname(path)
+        self.log_file = path if not os.path.isdir(path) else os.path.join(path, 'output.log')
+        self.name = os.path.basename(os.path.abspath(self.run_dir))
+        self.metrics_dir = os.path.join(self.run_dir, 'metrics')
+        self.offset = 0
+        self.remainder = ''
+        self.train = np.zeros((0, len(FIELDS)))
+        self.val = np.zeros((0, len(FIELDS)))
+        self.train_smooth = RunningMean(window_size)
+
+    def read(self):
+        """
+        :return: whether there are new results
+        """
+        if os.path.exists(os.path.join(self.metrics_dir, 'evaluation.bin')):
+            train, val = self.read_metrics()
+        else:
+            train, val = self.read_log()
+        self.train = np.concatenate([self.train, train])
+        self.val = np.concatenate([self.val, val])
+        self.train_smooth.extend(train)
+        return len(train) > 0 or len(val) > 0
+
+    def read_metrics(self):
+        records = load_metrics(self.metrics_dir, 'evaluation', self.offset)
+        self.offset += len(records)
+        rows = np.stack([records['episode'], records['success_rate'], records['collision_rate'],
+                         records['nav_time'], records['reward']], axis=1).astype(float)
+        return rows[records['phase'] == PHASES.index('train')], rows[records['phase'] == PHASES.index('val')]
+
+    def read_log(self):
+        train = []
+        val = []
+        if os.path.exists(self.log_file):
+            with open(self.log_file, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+            self.offset += len(data)
+            # a line that is still being written is completed by the next read
+            lines = (self.remainder + data.decode(errors='replace')).split('\n')
+            self.remainder = lines.pop()
+            for line in lines:
+                match = LOG_PATTERN.search(line)
+                if match is not None:
+                    row = [float(match.group(field)) for field in FIELDS]
+                    (train if match.group('phase') == 'TRAIN' else val).append(row)
+        return np.array(train).reshape(-1, len(FIELDS)), np.array(val).reshape(-1, len(FIELDS))
+
+
+def find_runs(paths):
+    """
+    Runs are output directories or log files, other directories are searched for runs one level deep
+
+    """
+    runs = []
+    for path in paths:
+        if not os.path.isdir(path) or os.path.exists(os.path.join(path, 'output.log')):
+            runs.append(path)
+        else:
+            runs += sorted(os.path.join(path, name) for name in os.listdir(path)
+                           if os.path.exists(os.path.join(path, name, 'output.log')))
+    return runs
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('log_files', type=str, nargs='+')
+    parser.add_argument('log_files', type=str, nargs='+', help='log files, run directories or directories of runs')
     parser.add_argument('--plot_sr', default=False, action='store_true')
     parser.add_argument('--plot_cr', default=False, action='store_true')
     parser.add_argument('--plot_time', default=False, action='store_true')
@@ -19,126 +124,66 @@ def main():
     parser.add_argument('--plot_train', default=True, action='store_true')
     parser.add_argument('--plot_val', default=False, action='store_true')
     parser.add_argument('--window_size', type=int, default=200)
+    parser.add_argument('--max_episodes', type=int, default=None)
+    parser.add_argument('--follow', default=False, action='store_true',
+                        help='keep reading new results and new runs and refresh the figures')
+    parser.add_argument('--interval', type=float, default=10, help='seconds between refreshes when following')
     args = parser.parse_args()
 
-    # define the names of the models you want to plot and the longest episodes you want to show
-    models = ['LSTM-RL', 'SARL', 'OM-SARL']
-    max_episodes = 10000
-
-    ax1 = ax2 = ax3 = ax4 = None
-    ax1_legends = []
-    ax2_legends = []
-    ax3_legends = []
-    ax4_legends = []
-
-    for i, log_file in enumerate(args.log_files):
-        with open(log_file, 'r') as file:
-            log = file.read()
-
-        val_pattern = r"VAL   in episode (?P<episode>\d+) has success rate: (?P<sr>[0-1].\d+), " \
-                      r"collision rate: (?P<cr>[0-1].\d+), nav time: (?P<time>\d+.\d+), " \
-                      r"total reward: (?P<reward>[-+]?\d+.\d+)"
-        val_episode = []
-        val_sr = []
-        val_cr = []
-        val_time = []
-        val_reward = []
-        for r in re.findall(val_pattern, log):
-            val_episode.append(int(r[0]))
-            val_sr.append(float(r[1]))
-            val_cr.append(float(r[2]))
-            val_time.append(float(r[3]))
-            val_reward.append(float(r[4]))
-
-        train_pattern = r"TRAIN in episode (?P<episode>\d+) has success rate: (?P<sr>[0-1].\d+), " \
-                        r"collision rate: (?P<cr>[0-1].\d+), nav time: (?P<time>\d+.\d+), " \
-                        r"total reward: (?P<reward>[-+]?\d+.\d+)"
-        train_episode = []
-        train_sr = []
-        train_cr = []
-        train_time = []
-        train_reward = []
-        for r in re.findall(train_pattern, log):
-            train_episode.append(int(r[0]))
-            train_sr.append(float(r[1]))
-            train_cr.append(float(r[2]))
-            train_time.append(float(r[3]))
-            train_reward.append(float(r[4]))
-        train_episode = train_episode[:max_episodes]
-        train_sr = train_sr[:max_episodes]
-        train_cr = train_cr[:max_episodes]
-        train_time = train_time[:max_episodes]
-        train_reward = train_reward[:max_episodes]
-
-        # smooth training plot
-        train_sr_smooth = running_mean(train_sr, args.window_size)
-        train_cr_smooth = running_mean(train_cr, args.window_size)
-        train_time_smooth = running_mean(train_time, args.window_size)
-        train_reward_smooth = running_mean(train_reward, args.window_size)
-
-        # plot sr
-        if args.plot_sr:
-            if ax1 is None:
-                _, ax1 = plt.subplots()
-            if args.plot_train:
-                ax1.plot(range(len(train_sr_smooth)), train_sr_smooth)
-                ax1_legends.append(models[i])
-            if args.plot_val:
-                ax1.plot(val_episode, val_sr)
-                ax1_legends.append(models[i])
-
-            ax1.legend(ax1_legends)
-            ax1.set_xlabel('Episodes')
-            ax1.set_ylabel('Success Rate')
-            ax1.set_title('Success rate')
-
-        # plot time
-        if args.plot_time:
-            if ax2 is None:
-                _, ax2 = plt.subplots()
+    plots = [(args.plot_sr, FIELDS.index('sr'), 'Success Rate', 'Success rate'),
+             (args.plot_time, FIELDS.index('time'), 'Time(s)', "Robot's Time to Reach Goal"),
+             (args.plot_cr, FIELDS.index('cr'), 'Collision Rate', 'Collision Rate'),
+             (args.plot_reward, FIELDS.index('reward'), 'Reward', 'Cumulative Discounted Reward')]
+    axes = []
+    for enabled, _, ylabel, title in plots:
+        if enabled:
+            _, ax = plt.subplots()
+            ax.set_xlabel('Episodes')
+            ax.set_ylabel(ylabel)
+            ax.set_title(title)
+            axes.append(ax)
+        else:
+            axes.append(None)
+
+    readers = {}
+    lines = {}
+    drawn = set()
+    if args.follow:
+        plt.ion()
+    while True:
+        for run in find_runs(args.log_files):
+            if run not in readers:
+                readers[run] = RunReader(run, args.window_size)
+        changed = False
+        for run, reader in readers.items():
+            if not reader.read() and run in drawn:
+                continue
+            changed = True
+            drawn.add(run)
+            series = []
             if args.plot_train:
-                ax2.plot(range(len(train_time_smooth)), train_time_smooth)
-                ax2_legends.append(models[i])
+                series.append(('', reader.train_smooth.means))
             if args.plot_val:
-                ax2.plot(val_episode, val_time)
-                ax2_legends.append(models[i])
-
-            ax2.legend(ax2_legends)
-            ax2.set_xlabel('Episodes')
-            ax2.set_ylabel('Time(s)')
-            ax2.set_title("Robot's Time to Reach Goal")
-
-        # plot cr
-        if args.plot_cr:
-            if ax3 is None:
-                _, ax3 = plt.subplots()
-            if args.plot_train:
-                ax3.plot(range(len(train_cr_smooth)), train_cr_smooth)
-                ax3_legends.append(models[i])
-            if args.plot_val:
-                ax3.plot(val_episode, val_cr)
-                ax3_legends.append(models[i])
-
-            ax3.legend(ax3_legends)
-            ax3.set_xlabel('Episodes')
-            ax3.set_ylabel('Collision Rate')
-            ax3.set_title('Collision Rate')
-
-        # plot reward
-        if args.plot_reward:
-            if ax4 is None:
-                _, ax4 = plt.subplots()
-            if args.plot_train:
-                ax4.plot(range(len(train_reward_smooth)), train_reward_smooth)
-                ax4_legends.append(models[i])
-            if args.plot_val:
-                ax4.plot(val_episode, val_reward)
-                ax4_legends.append(models[i])
-
-            ax4.legend(ax4_legends)
-            ax4.set_xlabel('Episodes')
-            ax4.set_ylabel('Reward')
-            ax4.set_title('Cumulative Discounted Reward')
+                series.append((' val', reader.val))
+            for (_, column, _, _), ax in zip(plots, axes):
+                if ax is None:
+                    continue
+                for suffix, rows in series:
+                    if args.max_episodes is not None:
+                        rows = rows[rows[:, 0] < args.max_episodes]
+                    key = (run, column, suffix)
+                    if key not in lines:
+                        lines[key] = ax.plot([], [], label=reader.name + suffix)[0]
+                    lines[key].set_data(rows[:, 0], rows[:, column])
+        if changed:
+            for ax in axes:
+                if ax is not None:
+                    ax.relim()
+                    ax.autoscale_view()
+                    ax.legend()
+        if not args.follow:
+            break
+        plt.pause(args.interval)
 
     plt.show()
 
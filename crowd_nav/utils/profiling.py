@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextlib
+from collections import Counter
+import torch
+
+PROFILE_MODES = ('cprofile', 'sampling', 'torch')
+
+
+class StackSampler(object):
+    def __init__(self, interval=0.005):
+        """
+        Sample the call stack of the thread that starts the sampler from a background thread
+
+        """
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def run(self):
+        while self.running:
+            # the only way to read the stack of another thread, there is no public API for it
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                # collapsed stack format: frames from the outermost call separated by semicolons
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def write(self, collapsed_file, stats_file):
+        """
+        Write the samples as collapsed stacks for flamegraph tools and the functions sorted by inclusive samples
+
+        """
+        with open(collapsed_file, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        total = Counter()
+        own = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            # recursive functions are counted once per sample
+            for frame in set(frames):
+                total[frame] += count
+            own[frames[-1]] += count
+        samples = sum(self.stacks.values())
+        with open(stats_file, 'w') as f:
+            f.write('{} samples every {:.1f} ms\n'.format(samples, self.interval * 1000))
+            f.write('{:>10} {:>8} {:>10} {:>8}  {}\n'.format('total', '%', 'own', '%', 'function'))
+            for frame, count in total.most_common():
+                f.write('{:>10} {:>8.2f} {:>10} {:>8.2f}  {}\n'.format(count, count / samples * 100, own[frame],
+                                                                      own[frame] / samples * 100, frame))
+
+
+class Profiler(object):
+    def __init__(self, mode, output_dir, phase, count):
+        """
+        Profile the first count runs of one phase of the program, all other code runs without profiler
+
+        :param mode: one of PROFILE_MODES, torch records traces of the tensor operations of value networks
+        :param phase: name of the profiled phase as passed to profile()
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError('Unknown profile mode: {}'.format(mode))
+        self.mode = mode
+        self.output_dir = output_dir
+        self.phase = phase
+        self.count = count
+        self.runs = 0
+        self.profiler = cProfile.Profile() if mode == 'cprofile' else StackSampler() if mode == 'sampling' else None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def profile(self, phase):
+        """
+        :return: context manager that profiles the code in it if the phase is profiled
+        """
+        if phase != self.phase or self.runs >= self.count:
+            return contextlib.nullcontext()
+        self.runs += 1
+        if self.mode == 'torch':
+            return self.torch_profile()
+        return self.sample_profile() if self.mode == 'sampling' else self.cprofile()
+
+    @contextlib.contextmanager
+    def cprofile(self):
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    @contextlib.contextmanager
+    def sample_profile(self):
+        self.profiler.start()
+        try:
+            yield
+        finally:
+            self.profiler.stop()
+
+    @contextlib.contextmanager
+    def torch_profile(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, record_shapes=True) as profiler:
+            yield
+        # every run is a separate trace, so that the other phases between runs are not recorded
+        prefix = os.path.join(self.output_dir, 'torch_{}_{}'.format(self.phase, self.runs))
+        profiler.export_chrome_trace(prefix + '.json')
+        with open(prefix + '.txt', 'w') as f:
+            f.write(profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=50))
+
+    def close(self):
+        """
+        Write the results of cprofile and sampling profiles
+        """
+        if self.runs == 0:
+            logging.warning('Phase %s was never run, nothing is profiled', self.phase)
+            return
+        prefix = os.path.join(self.output_dir, '{}_{}'.format(self.mode, self.phase))
+        if self.mode == 'cprofile':
+            self.profiler.dump_stats(prefix + '.prof')
+            with open(prefix + '.txt', 'w') as f:
+                pstats.Stats(self.profiler, stream=f).sort_stats('cumulative').print_stats()
+            with open(prefix + '_tottime.txt', 'w') as f:
+                pstats.Stats(self.profiler, stream=f).sort_stats('tottime').print_stats()
+        elif self.mode == 'sampling':
+            self.profiler.write(prefix + '.collapsed', prefix + '.txt')
+        logging.info('Profile of %d runs of %s is saved in %s', self.runs, self.phase, self.output_dir)
@@ -0,0 +1,154 @@
+import time
+import subprocess
+import numpy as np
+from crowd_nav.utils.episode_store import EpisodeStore
+
+
+def orientation_segments(states, kinematics):
+    """
+    Compute the start and end point of the orientation arrow of each agent in each step
+
+    :param states: array of shape (steps, agents, 9)
+    :return: array of shape (steps, arrows, 2, 2), only the robot has an arrow for unicycle kinematics
+    """
+    radius = states[0, 0, 4]
+    if kinematics == 'unicycle':
+        states = states[:, :1]
+        theta = states[:, :, 8]
+    else:
+        theta = np.arctan2(states[:, :, 3], states[:, :, 2])
+    start = states[:, :, :2]
+    end = start + radius * np.stack([np.cos(theta), np.sin(theta)], axis=2)
+    return np.stack([start, end], axis=2)
+
+
+def render_video(states, time_step, kinematics, output_file, fps=8, ffmpeg='ffmpeg'):
+    """
+    Render an episode headless with the Agg backend and pipe the raw frames to ffmpeg.
+    All artists are created once and updated in every frame.
+
+    :return: number of rendered frames
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.lines as mlines
+    from matplotlib import patches
+
+    x_offset = 0.11
+    y_offset = 0.11
+    robot_color = 'yellow'
+    goal_color = 'red'
+    arrow_color = 'red'
+    arrow_style = patches.ArrowStyle("->", head_length=4, head_width=2)
+    human_num = states.shape[1] - 1
+
+    fig, ax = plt.subplots(figsize=(7, 7))
+    ax.tick_params(labelsize=16)
+    ax.set_xlim(-6, 6)
+    ax.set_ylim(-6, 6)
+    ax.set_xlabel('x(m)', fontsize=16)
+    ax.set_ylabel('y(m)', fontsize=16)
+    goal = mlines.Line2D([states[0, 0, 5]], [states[0, 0, 6]], color=goal_color, marker='*', linestyle='None',
+                         markersize=15, label='Goal')
+    robot = plt.Circle(states[0, 0, :2], states[0, 0, 4], fill=True, color=robot_color)
+    ax.add_artist(robot)
+    ax.add_artist(goal)
+    plt.legend([robot, goal], ['Robot', 'Goal'], fontsize=16)
+    humans = [plt.Circle(states[0, i + 1, :2], states[0, i + 1, 4], fill=False) for i in range(human_num)]
+    human_numbers = [plt.text(states[0, i + 1, 0] - x_offset, states[0, i + 1, 1] - y_offset, str(i),
+                              color='black', fontsize=12) for i in range(human_num)]
+    for human, human_number in zip(humans, human_numbers):
+        ax.add_artist(human)
+        ax.add_artist(human_number)
+    time_text = plt.text(-1, 5, 'Time: {}'.format(0), fontsize=16)
+    ax.add_artist(time_text)
+    segments = orientation_segments(states, kinematics)
+    arrows = [patches.FancyArrowPatch(*segment, color=arrow_color, arrowstyle=arrow_style)
+              for segment in segments[0]]
+    for arrow in arrows:
+        ax.add_artist(arrow)
+
+    fig.canvas.draw()
+    height, width = np.asarray(fig.canvas.buffer_rgba()).shape[:2]
+    encoder = subprocess.Popen([ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                                '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-',
+                                '-pix_fmt', 'yuv420p', '-vcodec', 'libx264', output_file], stdin=subprocess.PIPE)
+    try:
+        for frame in range(len(states)):
+            robot.center = states[frame, 0, :2]
+            for i, human in enumerate(humans):
+                human.center = states[frame, i + 1, :2]
+                human_numbers[i].set_position((states[frame, i + 1, 0] - x_offset, states[frame, i + 1, 1] - y_offset))
+            for arrow, segment in zip(arrows, segments[frame]):
+                arrow.set_positions(*segment)
+            time_text.set_text('Time: {:.2f}'.format(frame * time_step))
+            fig.canvas.draw()
+            encoder.stdin.write(fig.canvas.buffer_rgba())
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+        plt.close(fig)
+    if encoder.returncode != 0:
+        raise RuntimeError('ffmpeg exited with code {}'.format(encoder.returncode))
+    return len(states)
+
+
+def render_traj(states, time_step, output_file):
+    """
+    Plot the trajectories of an episode into a static image, paths are drawn as line collections
+
+    :return: number of rendered steps
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection, PatchCollection
+
+    robot_color = 'yellow'
+    human_num = states.shape[1] - 1
+    colors = plt.get_cmap('hsv')(np.linspace(0, 1, 10, endpoint=False))
+    agent_colors = [robot_color] + [colors[i % 10] for i in range(human_num)]
+
+    fig, ax = plt.subplots(figsize=(7, 7))
+    ax.tick_params(labelsize=16)
+    ax.set_xlim(-5, 5)
+    ax.set_ylim(-5, 5)
+    ax.set_xlabel('x(m)', fontsize=16)
+    ax.set_ylabel('y(m)', fontsize=16)
+    ax.add_collection(LineCollection([states[:, i, :2] for i in range(human_num + 1)], colors=agent_colors))
+    steps = sorted(set(range(0, len(states), 4)) | {len(states) - 1})
+    for i in range(human_num + 1):
+        circles = [plt.Circle(states[k, i, :2], states[k, i, 4]) for k in steps]
+        ax.add_collection(PatchCollection(circles, facecolor=robot_color if i == 0 else 'none',
+                                          edgecolor=agent_colors[i]))
+    for k in steps:
+        if (k * time_step) % 4 == 0 or k == len(states) - 1:
+            for i in range(human_num + 1):
+                ax.text(states[k, i, 0] - 0.11, states[k, i, 1] - 0.11, '{:.1f}'.format(k * time_step),
+                        color='black', fontsize=14, clip_on=True)
+    ax.legend([plt.Circle((0, 0), 0.3, color=robot_color)], ['Robot'], fontsize=16)
+    fig.savefig(output_file)
+    plt.close(fig)
+    return len(states)
+
+
+def render_job(job):
+    """
+    Render one stored episode in a worker process
+
+    :param job: tuple of (store directory, episode index, output file, mode, fps, ffmpeg executable)
+    :return: tuple of (episode index, rendered frames, seconds, error message or None)
+    """
+    store_dir, index, output_file, mode, fps, ffmpeg = job
+    start = time.time()
+    try:
+        store = EpisodeStore(store_dir)
+        states = np.array(store.episode_states(index))
+        if mode == 'traj':
+            frames = render_traj(states, store.time_step, output_file)
+        else:
+            frames = render_video(states, store.time_step, store.meta['kinematics'], output_file, fps, ffmpeg)
+    except (RuntimeError, OSError) as e:
+        return index, 0, time.time() - start, str(e)
+    return index, frames, time.time() - start, None
@@ -1,21 +1,54 @@
+import time
 import logging
+import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.autograd import Variable
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, default_collate
+from crowd_sim.envs.utils import timing
 
 
 class Trainer(object):
-    def __init__(self, model, memory, device, batch_size):
+    def __init__(self, model, memory, device, batch_size, metrics=None):
         """
         Train the trainable model of a policy
+
+        :param metrics: optional MetricsWriter, the loss and throughput of every optimization call are recorded
         """
         self.model = model
         self.device = device
         self.criterion = nn.MSELoss().to(device)
         self.memory = memory
+        self.batch_size = batch_size
+        # a prioritized memory samples its own batches and is updated with the errors of the batch
+        self.prioritized = hasattr(memory, 'update_priorities')
         self.data_loader = DataLoader(memory, batch_size, shuffle=True)
         self.optimizer = None
+        self.target_model = None
+        self.metrics = metrics
+
+    def set_target_model(self, target_model):
+        """
+        Model computing the value targets of lazily stored transitions
+        """
+        self.target_model = target_model
+
+    def split_batch(self, batch):
+        """
+        :param batch: collated (inputs, values) or lazily stored (inputs, rewards, next inputs, discounts), where the
+        discount of terminal transitions is 0
+        :return: tuple of (inputs, values)
+        """
+        if len(batch) == 2:
+            return batch
+        inputs, rewards, next_inputs, discounts = batch
+        if not discounts.any():
+            return inputs, rewards
+        if self.target_model is None:
+            raise ValueError('Target model is not set!')
+        with torch.no_grad():
+            values = rewards + discounts * self.target_model(next_inputs)
+        return inputs, values
 
     def set_learning_rate(self, learning_rate):
         logging.info('Current learning rate: %f', learning_rate)
@@ -24,11 +57,13 @@ class Trainer(object):
     def optimize_epoch(self, num_epochs):
         if self.optimizer is None:
             raise ValueError('Learning rate is not set!')
+        start = time.time()
+        batches = 0
         average_epoch_loss = 0
         for epoch in range(num_epochs):
             epoch_loss = 0
             for data in self.data_loader:
-                inputs, values = data
+                inputs, values = self.split_batch(data)
                 inputs = Variable(inputs)
                 values = Variable(values)
 
@@ -38,29 +73,56 @@ class Trainer(object):
                 loss.backward()
                 self.optimizer.step()
                 epoch_loss += loss.data.item()
+                batches += 1
 
             average_epoch_loss = epoch_loss / len(self.memory)
             logging.debug('Average loss in epoch %d: %.2E', epoch, average_epoch_loss)
 
+        if self.metrics is not None:
+            self.metrics.optimization(num_epochs, batches, average_epoch_loss, len(self.memory), time.time() - start)
         return average_epoch_loss
 
     def optimize_batch(self, num_batches):
         if self.optimizer is None:
             raise ValueError('Learning rate is not set!')
+        start = time.time()
         losses = 0
         for _ in range(num_batches):
-            inputs, values = next(iter(self.data_loader))
-            inputs = Variable(inputs)
-            values = Variable(values)
+            with timing.timer('trainer.batch'):
+                if self.prioritized:
+                    loss = self.prioritized_loss()
+                else:
+                    with timing.timer('trainer.sample'):
+                        inputs, values = self.split_batch(next(iter(self.data_loader)))
+                    inputs = Variable(inputs)
+                    values = Variable(values)
 
-            self.optimizer.zero_grad()
-            outputs = self.model(inputs)
-            loss = self.criterion(outputs, values)
-            loss.backward()
-            self.optimizer.step()
-            losses += loss.data.item()
+                    self.optimizer.zero_grad()
+                    outputs = self.model(inputs)
+                    loss = self.criterion(outputs, values)
+                loss.backward()
+                self.optimizer.step()
+                losses += loss.data.item()
 
         average_loss = losses / num_batches
         logging.debug('Average loss : %.2E', average_loss)
 
+        if self.metrics is not None:
+            self.metrics.optimization(0, num_batches, average_loss, len(self.memory), time.time() - start)
         return average_loss
+
+    def prioritized_loss(self):
+        """
+        Squared errors of a prioritized batch weighted by their importance-sampling weights, the absolute errors
+        become the new priorities of the sampled items
+
+        """
+        with timing.timer('trainer.sample'):
+            indices, weights = self.memory.sample(self.batch_size)
+            inputs, values = self.split_batch(default_collate([self.memory[index] for index in indices]))
+        weights = torch.as_tensor(weights, dtype=torch.float32, device=values.device).view(-1, 1)
+
+        self.optimizer.zero_grad()
+        errors = self.model(inputs) - values
+        self.memory.update_priorities(indices, errors.detach().abs().view(-1).cpu().numpy())
+        return torch.mean(weights * errors.pow(2))
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class ValueCache(object):
+    def __init__(self, capacity, resolution):
+        """
+        Transposition cache from quantized value network inputs to state values with LRU eviction, an entry can
+        hold other outputs of the network next to the value
+
+        """
+        self.capacity = capacity
+        self.resolution = resolution
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def keys(self, inputs):
+        """
+        :param inputs: tensor of shape (batch_size, # of humans, input dim)
+        :return: list of hashable keys, one per batch element
+        """
+        quantized = np.round(inputs.cpu().numpy() / self.resolution).astype(np.int32)
+        return [element.tobytes() for element in quantized]
+
+    def get(self, key):
+        value = self.values.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.values.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.values[key] = value
+        self.values.move_to_end(key)
+        if len(self.values) > self.capacity:
+            self.values.popitem(last=False)
+
+    def clear(self):
+        self.values.clear()
@@ -1,13 +1,12 @@
 import logging
 import gym
-import matplotlib.lines as mlines
 import numpy as np
-import rvo2
-from matplotlib import patches
 from numpy.linalg import norm
 from crowd_sim.envs.utils.human import Human
 from crowd_sim.envs.utils.info import *
+from crowd_sim.envs.utils.recorder import EpisodeRecorder
 from crowd_sim.envs.utils.utils import point_to_segment_dist
+from crowd_sim.envs.utils import timing
 
 
 class CrowdSim(gym.Env):
@@ -27,6 +26,13 @@ class CrowdSim(gym.Env):
         self.humans = None
         self.global_time = None
         self.human_times = None
+        # training episodes without progress toward the goal are ended early as timeouts
+        self.stall_window = None
+        self.stall_progress = None
+        # turned off while the robot runs a demonstrator policy, whose slow episodes are still used
+        self.stall_detection = True
+        self.detect_stalls = None
+        self.goal_distances = None
         # reward function
         self.success_reward = None
         self.collision_penalty = None
@@ -43,16 +49,21 @@ class CrowdSim(gym.Env):
         self.square_width = None
         self.circle_radius = None
         self.human_num = None
+        # humans are taken from the pool and reinitialized in every reset instead of being constructed
+        self.human_pool = None
+        self.pool_index = None
         # for visualization
-        self.states = None
-        self.action_values = None
-        self.attention_weights = None
+        self.record_mode = None
+        self.train_record_mode = None
+        self.recorder = None
 
     def configure(self, config):
         self.config = config
         self.time_limit = config.getint('env', 'time_limit')
         self.time_step = config.getfloat('env', 'time_step')
         self.randomize_attributes = config.getboolean('env', 'randomize_attributes')
+        self.stall_window = config.getint('env', 'stall_window', fallback=0)
+        self.stall_progress = config.getfloat('env', 'stall_progress', fallback=0.5)
         self.success_reward = config.getfloat('reward', 'success_reward')
         self.collision_penalty = config.getfloat('reward', 'collision_penalty')
         self.discomfort_dist = config.getfloat('reward', 'discomfort_dist')
@@ -69,6 +80,12 @@ class CrowdSim(gym.Env):
         else:
             raise NotImplementedError
         self.case_counter = {'train': 0, 'test': 0, 'val': 0}
+        self.human_pool = []
+        self.pool_index = 0
+        # training episodes are not recorded by default since nothing reads them
+        self.record_mode = config.get('env', 'record_mode', fallback='array')
+        self.train_record_mode = config.get('env', 'train_record_mode', fallback='off')
+        self.recorder = EpisodeRecorder(config.get('env', 'record_dir', fallback='') or None)
 
         logging.info('human number: {}'.format(self.human_num))
         if self.randomize_attributes:
@@ -81,6 +98,22 @@ class CrowdSim(gym.Env):
     def set_robot(self, robot):
         self.robot = robot
 
+    def get_record_mode(self, phase):
+        return self.train_record_mode if phase == 'train' else self.record_mode
+
+    def get_pooled_human(self):
+        """
+        Take the next human from the agent pool, constructing a new one only if the pool is exhausted.
+        Pooled humans keep their policy, so the ORCA simulators are reused across episodes as well.
+
+        """
+        if self.pool_index == len(self.human_pool):
+            self.human_pool.append(Human(self.config, 'humans'))
+        human = self.human_pool[self.pool_index]
+        self.pool_index += 1
+        human.reinitialize()
+        return human
+
     def generate_random_human_position(self, human_num, rule):
         """
         Generate human position according to certain rule
@@ -119,11 +152,11 @@ class CrowdSim(gym.Env):
                 width = 4
                 height = 8
                 if human_num == 0:
-                    human = Human(self.config, 'humans')
+                    human = self.get_pooled_human()
                     human.set(0, -10, 0, -10, 0, 0, 0)
                     self.humans.append(human)
                 for i in range(human_num):
-                    human = Human(self.config, 'humans')
+                    human = self.get_pooled_human()
                     if np.random.random() > 0.5:
                         sign = -1
                     else:
@@ -153,7 +186,7 @@ class CrowdSim(gym.Env):
             raise ValueError("Rule doesn't exist")
 
     def generate_circle_crossing_human(self):
-        human = Human(self.config, 'humans')
+        human = self.get_pooled_human()
         if self.randomize_attributes:
             human.sample_random_attributes()
         while True:
@@ -176,7 +209,7 @@ class CrowdSim(gym.Env):
         return human
 
     def generate_square_crossing_human(self):
-        human = Human(self.config, 'humans')
+        human = self.get_pooled_human()
         if self.randomize_attributes:
             human.sample_random_attributes()
         if np.random.random() > 0.5:
@@ -206,46 +239,61 @@ class CrowdSim(gym.Env):
         human.set(px, py, gx, gy, 0, 0, 0)
         return human
 
-    def get_human_times(self):
+    def get_human_times(self, record=True, max_time=1000):
         """
         Run the whole simulation to the end and compute the average time for human to reach goal.
         Once an agent reaches the goal, it stops moving and becomes an obstacle
         (doesn't need to take half responsibility to avoid collision).
+        Preferred velocities and goal checks are computed for all agents at once.
 
+        :param record: record the states of the fast-forward simulation for visualization
+        :param max_time: the simulation is stopped after max_time, humans that haven't reached their goals by then
+        keep a time of 0
         :return:
         """
+        import rvo2
         # centralized orca simulator for all humans
         if not self.robot.reached_destination():
             raise ValueError('Episode is not done yet')
+        agents = [self.robot] + self.humans
         params = (10, 10, 5, 5)
         sim = rvo2.PyRVOSimulator(self.time_step, *params, 0.3, 1)
-        sim.addAgent(self.robot.get_position(), *params, self.robot.radius, self.robot.v_pref,
-                     self.robot.get_velocity())
-        for human in self.humans:
-            sim.addAgent(human.get_position(), *params, human.radius, human.v_pref, human.get_velocity())
-
-        max_time = 1000
-        while not all(self.human_times):
-            for i, agent in enumerate([self.robot] + self.humans):
-                vel_pref = np.array(agent.get_goal_position()) - np.array(agent.get_position())
-                if norm(vel_pref) > 1:
-                    vel_pref /= norm(vel_pref)
-                sim.setAgentPrefVelocity(i, tuple(vel_pref))
+        for agent in agents:
+            sim.addAgent(agent.get_position(), *params, agent.radius, agent.v_pref, agent.get_velocity())
+
+        human_num = len(self.human_times)
+        positions = np.array([agent.get_position() for agent in agents], dtype=float)
+        goals = np.array([agent.get_goal_position() for agent in agents], dtype=float)
+        human_radius = np.array([human.radius for human in self.humans[:human_num]])
+        human_times = np.array(self.human_times, dtype=float)
+        max_steps = int(np.ceil((max_time - self.global_time) / self.time_step))
+        for _ in range(max_steps):
+            if np.all(human_times != 0):
+                break
+            vel_prefs = goals - positions
+            speeds = norm(vel_prefs, axis=1, keepdims=True)
+            vel_prefs = np.divide(vel_prefs, speeds, out=vel_prefs, where=speeds > 1)
+            for i, vel_pref in enumerate(vel_prefs):
+                sim.setAgentPrefVelocity(i, (vel_pref[0], vel_pref[1]))
             sim.doStep()
             self.global_time += self.time_step
-            if self.global_time > max_time:
+            positions = np.array([sim.getAgentPosition(i) for i in range(len(agents))])
+            # only record the first time the human reaches the goal
+            reached = norm(positions[1:human_num + 1] - goals[1:human_num + 1], axis=1) < human_radius
+            human_times[reached & (human_times == 0)] = self.global_time
+
+            if record:
+                for agent, position in zip(agents, positions):
+                    agent.set_position(position)
+                self.recorder.record(self.robot, self.humans)
+        else:
+            if not np.all(human_times != 0):
                 logging.warning('Simulation cannot terminate!')
-            for i, human in enumerate(self.humans):
-                if self.human_times[i] == 0 and human.reached_destination():
-                    self.human_times[i] = self.global_time
-
-            # for visualization
-            self.robot.set_position(sim.getAgentPosition(0))
-            for i, human in enumerate(self.humans):
-                human.set_position(sim.getAgentPosition(i + 1))
-            self.states.append([self.robot.get_full_state(), [human.get_full_state() for human in self.humans]])
+        for agent, position in zip(agents, positions):
+            agent.set_position(position)
 
         del sim
+        self.human_times = human_times.tolist()
         return self.human_times
 
     def reset(self, phase='test', test_case=None):
@@ -258,7 +306,12 @@ class CrowdSim(gym.Env):
         assert phase in ['train', 'val', 'test']
         if test_case is not None:
             self.case_counter[phase] = test_case
+        case = self.case_counter[phase]
         self.global_time = 0
+        self.pool_index = 0
+        # val and test episodes always run until the time limit to keep their metrics comparable
+        self.detect_stalls = phase == 'train' and self.stall_window > 0 and self.stall_detection
+        self.goal_distances = []
         if phase == 'test':
             self.human_times = [0] * self.human_num
         else:
@@ -286,7 +339,7 @@ class CrowdSim(gym.Env):
                 if self.case_counter[phase] == -1:
                     # for debugging purposes
                     self.human_num = 3
-                    self.humans = [Human(self.config, 'humans') for _ in range(self.human_num)]
+                    self.humans = [self.get_pooled_human() for _ in range(self.human_num)]
                     self.humans[0].set(0, -6, 0, 5, 0, 0, np.pi / 2)
                     self.humans[1].set(-5, -5, -5, 5, 0, 0, np.pi / 2)
                     self.humans[2].set(5, -5, 5, 5, 0, 0, np.pi / 2)
@@ -297,11 +350,8 @@ class CrowdSim(gym.Env):
             agent.time_step = self.time_step
             agent.policy.time_step = self.time_step
 
-        self.states = list()
-        if hasattr(self.robot.policy, 'action_values'):
-            self.action_values = list()
-        if hasattr(self.robot.policy, 'get_attention_weights'):
-            self.attention_weights = list()
+        self.recorder.set_mode(self.get_record_mode(phase))
+        self.recorder.start(len(self.humans) + 1, '{}_{}'.format(phase, case))
 
         # get current observation
         if self.robot.sensor == 'coordinates':
@@ -312,7 +362,8 @@ class CrowdSim(gym.Env):
         return ob
 
     def onestep_lookahead(self, action):
-        return self.step(action, update=False)
+        with timing.timer('env.lookahead'):
+            return self.step(action, update=False)
 
     def step(self, action, update=True):
         """
@@ -320,12 +371,14 @@ class CrowdSim(gym.Env):
 
         """
         human_actions = []
-        for human in self.humans:
-            # observation for humans is always coordinates
-            ob = [other_human.get_observable_state() for other_human in self.humans if other_human != human]
-            if self.robot.visible:
-                ob += [self.robot.get_observable_state()]
-            human_actions.append(human.act(ob))
+        with timing.timer('env.human_act'):
+            for human in self.humans:
+                # observation for humans is always coordinates
+                ob = [other_human.get_observable_state() for other_human in self.humans if other_human != human]
+                if self.robot.visible:
+                    ob += [self.robot.get_observable_state()]
+                human_actions.append(human.act(ob))
+        timing.count('env.human_acts', len(self.humans))
 
         # collision detection
         dmin = float('inf')
@@ -363,7 +416,11 @@ class CrowdSim(gym.Env):
 
         # check if reaching the goal
         end_position = np.array(self.robot.compute_position(action, self.time_step))
-        reaching_goal = norm(end_position - np.array(self.robot.get_goal_position())) < self.robot.radius
+        goal_distance = norm(end_position - np.array(self.robot.get_goal_position()))
+        reaching_goal = goal_distance < self.robot.radius
+        # oscillating robots also make no progress over the window
+        stalled = update and self.detect_stalls and len(self.goal_distances) >= self.stall_window and \
+            self.goal_distances[-self.stall_window] - goal_distance < self.stall_progress
 
         if self.global_time >= self.time_limit - 1:
             reward = 0
@@ -377,6 +434,10 @@ class CrowdSim(gym.Env):
             reward = self.success_reward
             done = True
             info = ReachGoal()
+        elif stalled:
+            reward = 0
+            done = True
+            info = Stalled()
         elif dmin < self.discomfort_dist:
             # only penalize agent for getting too close if it's visible
             # adjust the reward based on FPS
@@ -390,13 +451,18 @@ class CrowdSim(gym.Env):
 
         if update:
             # store state, action value and attention weights
-            self.states.append([self.robot.get_full_state(), [human.get_full_state() for human in self.humans]])
-            if hasattr(self.robot.policy, 'action_values'):
-                self.action_values.append(self.robot.policy.action_values)
-            if hasattr(self.robot.policy, 'get_attention_weights'):
-                self.attention_weights.append(self.robot.policy.get_attention_weights())
+            if self.recorder.enabled:
+                action_values = getattr(self.robot.policy, 'action_values', None)
+                attention_weights = None
+                if hasattr(self.robot.policy, 'get_attention_weights'):
+                    attention_weights = self.robot.policy.get_attention_weights()
+                self.recorder.record(self.robot, self.humans, action_values, attention_weights)
+                if done:
+                    self.recorder.finish()
 
             # update all agents
+            if self.detect_stalls:
+                self.goal_distances.append(goal_distance)
             self.robot.step(action)
             for i, human_action in enumerate(human_actions):
                 self.humans[i].step(human_action)
@@ -420,7 +486,8 @@ class CrowdSim(gym.Env):
         return ob, reward, done, info
 
     def render(self, mode='human', output_file=None):
-        from matplotlib import animation
+        from matplotlib import animation, patches
+        import matplotlib.lines as mlines
         import matplotlib.pyplot as plt
         plt.rcParams['animation.ffmpeg_path'] = '/usr/bin/ffmpeg'
 
@@ -431,6 +498,12 @@ class CrowdSim(gym.Env):
         goal_color = 'red'
         arrow_color = 'red'
         arrow_style = patches.ArrowStyle("->", head_length=4, head_width=2)
+        if mode in ['traj', 'video'] and self.recorder.states is None:
+            raise AttributeError('Episode has to be recorded for rendering!')
+        # recorded states of shape (steps, agents, 9), agent 0 is the robot
+        states = self.recorder.states
+        action_values = self.recorder.action_values
+        attention_weights = self.recorder.attention_weights
 
         if mode == 'human':
             fig, ax = plt.subplots(figsize=(7, 7))
@@ -449,34 +522,34 @@ class CrowdSim(gym.Env):
             ax.set_xlabel('x(m)', fontsize=16)
             ax.set_ylabel('y(m)', fontsize=16)
 
-            robot_positions = [self.states[i][0].position for i in range(len(self.states))]
-            human_positions = [[self.states[i][1][j].position for j in range(len(self.humans))]
-                               for i in range(len(self.states))]
-            for k in range(len(self.states)):
-                if k % 4 == 0 or k == len(self.states) - 1:
-                    robot = plt.Circle(robot_positions[k], self.robot.radius, fill=True, color=robot_color)
-                    humans = [plt.Circle(human_positions[k][i], self.humans[i].radius, fill=False, color=cmap(i))
-                              for i in range(len(self.humans))]
+            human_num = states.shape[1] - 1
+            robot_positions = states[:, 0, :2]
+            human_positions = states[:, 1:, :2]
+            for k in range(len(states)):
+                if k % 4 == 0 or k == len(states) - 1:
+                    robot = plt.Circle(robot_positions[k], states[k, 0, 4], fill=True, color=robot_color)
+                    humans = [plt.Circle(human_positions[k][i], states[k, i + 1, 4], fill=False, color=cmap(i))
+                              for i in range(human_num)]
                     ax.add_artist(robot)
                     for human in humans:
                         ax.add_artist(human)
                 # add time annotation
                 global_time = k * self.time_step
-                if global_time % 4 == 0 or k == len(self.states) - 1:
+                if global_time % 4 == 0 or k == len(states) - 1:
                     agents = humans + [robot]
                     times = [plt.text(agents[i].center[0] - x_offset, agents[i].center[1] - y_offset,
                                       '{:.1f}'.format(global_time),
-                                      color='black', fontsize=14) for i in range(self.human_num + 1)]
+                                      color='black', fontsize=14) for i in range(human_num + 1)]
                     for time in times:
                         ax.add_artist(time)
                 if k != 0:
-                    nav_direction = plt.Line2D((self.states[k - 1][0].px, self.states[k][0].px),
-                                               (self.states[k - 1][0].py, self.states[k][0].py),
+                    nav_direction = plt.Line2D((states[k - 1, 0, 0], states[k, 0, 0]),
+                                               (states[k - 1, 0, 1], states[k, 0, 1]),
                                                color=robot_color, ls='solid')
-                    human_directions = [plt.Line2D((self.states[k - 1][1][i].px, self.states[k][1][i].px),
-                                                   (self.states[k - 1][1][i].py, self.states[k][1][i].py),
+                    human_directions = [plt.Line2D((states[k - 1, i + 1, 0], states[k, i + 1, 0]),
+                                                   (states[k - 1, i + 1, 1], states[k, i + 1, 1]),
                                                    color=cmap(i), ls='solid')
-                                        for i in range(self.human_num)]
+                                        for i in range(human_num)]
                     ax.add_artist(nav_direction)
                     for human_direction in human_directions:
                         ax.add_artist(human_direction)
@@ -491,19 +564,21 @@ class CrowdSim(gym.Env):
             ax.set_ylabel('y(m)', fontsize=16)
 
             # add robot and its goal
-            robot_positions = [state[0].position for state in self.states]
-            goal = mlines.Line2D([0], [4], color=goal_color, marker='*', linestyle='None', markersize=15, label='Goal')
-            robot = plt.Circle(robot_positions[0], self.robot.radius, fill=True, color=robot_color)
+            human_num = states.shape[1] - 1
+            robot_positions = states[:, 0, :2]
+            goal = mlines.Line2D([states[0, 0, 5]], [states[0, 0, 6]], color=goal_color, marker='*',
+                                 linestyle='None', markersize=15, label='Goal')
+            robot = plt.Circle(robot_positions[0], states[0, 0, 4], fill=True, color=robot_color)
             ax.add_artist(robot)
             ax.add_artist(goal)
             plt.legend([robot, goal], ['Robot', 'Goal'], fontsize=16)
 
             # add humans and their numbers
-            human_positions = [[state[1][j].position for j in range(len(self.humans))] for state in self.states]
-            humans = [plt.Circle(human_positions[0][i], self.humans[i].radius, fill=False)
-                      for i in range(len(self.humans))]
+            human_positions = states[:, 1:, :2]
+            humans = [plt.Circle(human_positions[0][i], states[0, i + 1, 4], fill=False)
+                      for i in range(human_num)]
             human_numbers = [plt.text(humans[i].center[0] - x_offset, humans[i].center[1] - y_offset, str(i),
-                                      color='black', fontsize=12) for i in range(len(self.humans))]
+                                      color='black', fontsize=12) for i in range(human_num)]
             for i, human in enumerate(humans):
                 ax.add_artist(human)
                 ax.add_artist(human_numbers[i])
@@ -513,30 +588,27 @@ class CrowdSim(gym.Env):
             ax.add_artist(time)
 
             # compute attention scores
-            if self.attention_weights is not None:
+            if attention_weights is not None:
                 attention_scores = [
-                    plt.text(-5.5, 5 - 0.5 * i, 'Human {}: {:.2f}'.format(i + 1, self.attention_weights[0][i]),
-                             fontsize=16) for i in range(len(self.humans))]
+                    plt.text(-5.5, 5 - 0.5 * i, 'Human {}: {:.2f}'.format(i + 1, attention_weights[0][i]),
+                             fontsize=16) for i in range(human_num)]
 
             # compute orientation in each step and use arrow to show the direction
-            radius = self.robot.radius
+            radius = states[0, 0, 4]
             if self.robot.kinematics == 'unicycle':
-                orientation = [((state[0].px, state[0].py), (state[0].px + radius * np.cos(state[0].theta),
-                                                             state[0].py + radius * np.sin(state[0].theta))) for state
-                               in self.states]
+                orientation = [((state[0, 0], state[0, 1]), (state[0, 0] + radius * np.cos(state[0, 8]),
+                                                             state[0, 1] + radius * np.sin(state[0, 8])))
+                               for state in states]
                 orientations = [orientation]
             else:
                 orientations = []
-                for i in range(self.human_num + 1):
+                for i in range(human_num + 1):
                     orientation = []
-                    for state in self.states:
-                        if i == 0:
-                            agent_state = state[0]
-                        else:
-                            agent_state = state[1][i - 1]
-                        theta = np.arctan2(agent_state.vy, agent_state.vx)
-                        orientation.append(((agent_state.px, agent_state.py), (agent_state.px + radius * np.cos(theta),
-                                             agent_state.py + radius * np.sin(theta))))
+                    for state in states:
+                        agent_state = state[i]
+                        theta = np.arctan2(agent_state[3], agent_state[2])
+                        orientation.append(((agent_state[0], agent_state[1]), (agent_state[0] + radius * np.cos(theta),
+                                             agent_state[1] + radius * np.sin(theta))))
                     orientations.append(orientation)
             arrows = [patches.FancyArrowPatch(*orientation[0], color=arrow_color, arrowstyle=arrow_style)
                       for orientation in orientations]
@@ -546,35 +618,31 @@ class CrowdSim(gym.Env):
 
             def update(frame_num):
                 nonlocal global_step
-                nonlocal arrows
                 global_step = frame_num
                 robot.center = robot_positions[frame_num]
+                # move the existing arrows instead of re-creating them in every frame
+                for arrow, orientation in zip(arrows, orientations):
+                    arrow.set_positions(*orientation[frame_num])
                 for i, human in enumerate(humans):
                     human.center = human_positions[frame_num][i]
                     human_numbers[i].set_position((human.center[0] - x_offset, human.center[1] - y_offset))
-                    for arrow in arrows:
-                        arrow.remove()
-                    arrows = [patches.FancyArrowPatch(*orientation[frame_num], color=arrow_color,
-                                                      arrowstyle=arrow_style) for orientation in orientations]
-                    for arrow in arrows:
-                        ax.add_artist(arrow)
-                    if self.attention_weights is not None:
-                        human.set_color(str(self.attention_weights[frame_num][i]))
-                        attention_scores[i].set_text('human {}: {:.2f}'.format(i, self.attention_weights[frame_num][i]))
+                    if attention_weights is not None:
+                        human.set_color(str(attention_weights[frame_num][i]))
+                        attention_scores[i].set_text('human {}: {:.2f}'.format(i, attention_weights[frame_num][i]))
 
                 time.set_text('Time: {:.2f}'.format(frame_num * self.time_step))
 
             def plot_value_heatmap():
                 assert self.robot.kinematics == 'holonomic'
-                for agent in [self.states[global_step][0]] + self.states[global_step][1]:
-                    print(('{:.4f}, ' * 6 + '{:.4f}').format(agent.px, agent.py, agent.gx, agent.gy,
-                                                             agent.vx, agent.vy, agent.theta))
+                for agent in states[global_step]:
+                    print(('{:.4f}, ' * 6 + '{:.4f}').format(agent[0], agent[1], agent[5], agent[6],
+                                                             agent[2], agent[3], agent[8]))
                 # when any key is pressed draw the action value plot
                 fig, axis = plt.subplots()
                 speeds = [0] + self.robot.policy.speeds
                 rotations = self.robot.policy.rotations + [np.pi * 2]
                 r, th = np.meshgrid(speeds, rotations)
-                z = np.array(self.action_values[global_step % len(self.states)][1:])
+                z = np.array(action_values[global_step % len(states)][1:])
                 z = (z - np.min(z)) / (np.max(z) - np.min(z))
                 z = np.reshape(z, (16, 5))
                 polar = plt.subplot(projection="polar")
@@ -591,13 +659,13 @@ class CrowdSim(gym.Env):
                 anim.running ^= True
                 if anim.running:
                     anim.event_source.stop()
-                    if hasattr(self.robot.policy, 'action_values'):
+                    if action_values is not None:
                         plot_value_heatmap()
                 else:
                     anim.event_source.start()
 
             fig.canvas.mpl_connect('key_press_event', on_click)
-            anim = animation.FuncAnimation(fig, update, frames=len(self.states), interval=self.time_step * 1000)
+            anim = animation.FuncAnimation(fig, update, frames=len(states), interval=self.time_step * 1000)
             anim.running = True
 
             if output_file is not None:
@@ -1,5 +1,4 @@
 import numpy as np
-import rvo2
 from crowd_sim.envs.policy.policy import Policy
 from crowd_sim.envs.utils.action import ActionXY
 
@@ -65,6 +64,7 @@ class ORCA(Policy):
         self.radius = 0.3
         self.max_speed = 1
         self.sim = None
+        self.sims = dict()
 
     def configure(self, config):
         # self.time_step = config.getfloat('orca', 'time_step')
@@ -79,6 +79,13 @@ class ORCA(Policy):
     def set_phase(self, phase):
         return
 
+    def __getstate__(self):
+        # rvo2 simulators can't be copied, they are rebuilt on the next prediction
+        state = self.__dict__.copy()
+        state['sim'] = None
+        state['sims'] = dict()
+        return state
+
     def predict(self, state):
         """
         Create a rvo2 simulation at each time step and run one step
@@ -92,22 +99,30 @@ class ORCA(Policy):
         """
         self_state = state.self_state
         params = self.neighbor_dist, self.max_neighbors, self.time_horizon, self.time_horizon_obst
-        if self.sim is not None and self.sim.getNumAgents() != len(state.human_states) + 1:
-            del self.sim
-            self.sim = None
+        agent_num = len(state.human_states) + 1
+        if self.sim is None or self.sim.getNumAgents() != agent_num:
+            # simulators are kept per number of agents, so changing human numbers doesn't rebuild them
+            self.sim = self.sims.get(agent_num)
         if self.sim is None:
+            # rvo2 is only imported where it is used, so that importing the policies stays cheap
+            import rvo2
             self.sim = rvo2.PyRVOSimulator(self.time_step, *params, self.radius, self.max_speed)
             self.sim.addAgent(self_state.position, *params, self_state.radius + 0.01 + self.safety_space,
                               self_state.v_pref, self_state.velocity)
             for human_state in state.human_states:
                 self.sim.addAgent(human_state.position, *params, human_state.radius + 0.01 + self.safety_space,
                                   self.max_speed, human_state.velocity)
+            self.sims[agent_num] = self.sim
         else:
+            # radius and speed may differ between episodes when the simulator is reused
             self.sim.setAgentPosition(0, self_state.position)
             self.sim.setAgentVelocity(0, self_state.velocity)
+            self.sim.setAgentRadius(0, self_state.radius + 0.01 + self.safety_space)
+            self.sim.setAgentMaxSpeed(0, self_state.v_pref)
             for i, human_state in enumerate(state.human_states):
                 self.sim.setAgentPosition(i + 1, human_state.position)
                 self.sim.setAgentVelocity(i + 1, human_state.velocity)
+                self.sim.setAgentRadius(i + 1, human_state.radius + 0.01 + self.safety_space)
 
         # Set the preferred velocity to be a vector of unit magnitude (speed) in the direction of the goal.
         velocity = np.array((self_state.gx - self_state.px, self_state.gy - self_state.py))
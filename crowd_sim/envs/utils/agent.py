@@ -16,6 +16,9 @@ class Agent(object):
         self.visible = config.getboolean(section, 'visible')
         self.v_pref = config.getfloat(section, 'v_pref')
         self.radius = config.getfloat(section, 'radius')
+        # configured attributes are kept so that a pooled agent can be restored without re-parsing the config
+        self.default_v_pref = self.v_pref
+        self.default_radius = self.radius
         self.policy = policy_factory[config.get(section, 'policy')]()
         self.sensor = config.get(section, 'sensor')
         self.kinematics = self.policy.kinematics if self.policy is not None else None
@@ -36,6 +39,20 @@ class Agent(object):
         self.policy = policy
         self.kinematics = policy.kinematics
 
+    def reinitialize(self):
+        """
+        Restore configured attributes and clear the state so that the agent can be reused in a new episode
+        """
+        self.v_pref = self.default_v_pref
+        self.radius = self.default_radius
+        self.px = None
+        self.py = None
+        self.gx = None
+        self.gy = None
+        self.vx = None
+        self.vy = None
+        self.theta = None
+
     def sample_random_attributes(self):
         """
         Sample agent radius and v_pref attribute from certain distribution
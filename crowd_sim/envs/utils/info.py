@@ -6,6 +6,11 @@ class Timeout(object):
         return 'Timeout'
 
 
+class Stalled(Timeout):
+    def __str__(self):
+        return 'Stalled'
+
+
 class ReachGoal(object):
     def __init__(self):
         pass
@@ -0,0 +1,117 @@
+import os
+import numpy as np
+
+# column order of a recorded agent state, same as FullState
+STATE_FIELDS = ('px', 'py', 'vx', 'vy', 'radius', 'gx', 'gy', 'v_pref', 'theta')
+
+
+class EpisodeRecorder(object):
+    def __init__(self, output_dir=None, capacity=128):
+        """
+        Record the full states of all agents in one episode into growing float32 arrays of shape (T, agents, 9).
+
+        Recording modes:
+        off: nothing is recorded
+        array: states, action values and attention weights are kept in memory, e.g. for rendering
+        stream: same as array, and every finished episode is also written to a compressed file in output_dir
+
+        """
+        self.output_dir = output_dir
+        self.capacity = capacity
+        self.mode = 'off'
+        self.episode_name = None
+        self.length = 0
+        self._states = None
+        self._action_values = None
+        self._attention_weights = None
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def set_mode(self, mode):
+        assert mode in ['off', 'array', 'stream']
+        if mode == 'stream' and self.output_dir is None:
+            raise ValueError('Output directory has to be set for streaming episodes')
+        self.mode = mode
+
+    def start(self, agent_num, episode_name=None):
+        self.episode_name = episode_name
+        self.length = 0
+        self._action_values = None
+        self._attention_weights = None
+        if not self.enabled:
+            self._states = None
+        elif self._states is None or self._states.shape[1] != agent_num:
+            self._states = np.zeros((self.capacity, agent_num, len(STATE_FIELDS)), dtype=np.float32)
+
+    def record(self, robot, humans, action_values=None, attention_weights=None):
+        if not self.enabled:
+            return
+        if self.length == self._states.shape[0]:
+            self._states = self._grow(self._states)
+            if self._action_values is not None:
+                self._action_values = self._grow(self._action_values)
+            if self._attention_weights is not None:
+                self._attention_weights = self._grow(self._attention_weights)
+        step = self.length
+        for i, agent in enumerate([robot] + humans):
+            self._states[step, i] = (agent.px, agent.py, agent.vx, agent.vy, agent.radius, agent.gx, agent.gy,
+                                     agent.v_pref, agent.theta)
+        if action_values is not None:
+            if self._action_values is None:
+                self._action_values = np.full((self._states.shape[0], len(action_values)), np.nan, dtype=np.float32)
+            self._action_values[step] = action_values
+        if attention_weights is not None:
+            if self._attention_weights is None:
+                self._attention_weights = np.full((self._states.shape[0], len(attention_weights)), np.nan,
+                                                  dtype=np.float32)
+            self._attention_weights[step] = attention_weights
+        self.length += 1
+
+    def finish(self):
+        """
+        Called when the episode is done, writes the episode to disk in stream mode
+
+        """
+        if self.mode == 'stream' and self.length > 0:
+            os.makedirs(self.output_dir, exist_ok=True)
+            arrays = {'states': self.states}
+            if self._action_values is not None:
+                arrays['action_values'] = self.action_values
+            if self._attention_weights is not None:
+                arrays['attention_weights'] = self.attention_weights
+            np.savez_compressed(os.path.join(self.output_dir, '{}.npz'.format(self.episode_name)), **arrays)
+
+    def load(self, states, action_values=None, attention_weights=None):
+        """
+        Replace the recording with an episode loaded from disk, e.g. for rendering it without re-simulating
+
+        """
+        self._states = np.asarray(states, dtype=np.float32)
+        self._action_values = None if action_values is None else np.asarray(action_values, dtype=np.float32)
+        self._attention_weights = None if attention_weights is None else np.asarray(attention_weights,
+                                                                                    dtype=np.float32)
+        self.length = self._states.shape[0]
+
+    @staticmethod
+    def _grow(array):
+        grown = np.full((array.shape[0] * 2,) + array.shape[1:], np.nan, dtype=array.dtype)
+        grown[:array.shape[0]] = array
+        return grown
+
+    @property
+    def states(self):
+        return None if self._states is None else self._states[:self.length]
+
+    @property
+    def action_values(self):
+        return None if self._action_values is None else self._action_values[:self.length]
+
+    @property
+    def attention_weights(self):
+        return None if self._attention_weights is None else self._attention_weights[:self.length]
+
+    def nbytes(self):
+        return sum(array.nbytes for array in [self._states, self._action_values, self._attention_weights]
+                   if array is not None)
@@ -0,0 +1,114 @@
+"""
+Named timers and counters for the hot paths of simulation, policies and training. Timing is disabled by default,
+then timer() returns a shared context manager that does nothing and count() returns right away.
+
+    with timing.timer('env.step'):
+        ...
+    timing.count('env.steps')
+
+"""
+import os
+import json
+import time
+import logging
+import numpy as np
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Timer(object):
+    __slots__ = ('durations', 'start')
+
+    def __init__(self, durations):
+        self.durations = durations
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.durations.append(time.perf_counter() - self.start)
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timings(object):
+    def __init__(self):
+        """
+        Durations of the named timers and values of the counters since the last report
+
+        """
+        self.enabled = False
+        self.durations = dict()
+        self.counters = dict()
+
+    def enable(self):
+        self.enabled = True
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        if name not in self.durations:
+            self.durations[name] = []
+        return Timer(self.durations[name])
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        :return: dict from timer name to its count, total seconds and percentiles in milliseconds, and the counters
+        """
+        timers = dict()
+        for name, values in self.durations.items():
+            if not values:
+                continue
+            p50, p90, p99, maximum = np.percentile(values, [50, 90, 99, 100]) * 1000
+            timers[name] = {'count': len(values), 'total': float(np.sum(values)), 'p50': p50, 'p90': p90,
+                            'p99': p99, 'max': maximum}
+        return {'timers': timers, 'counters': dict(self.counters)}
+
+    def report(self, phase, episode=None, metrics_dir=None):
+        """
+        Log the timers and counters collected since the last report, append them to <metrics_dir>/timings.jsonl and
+        reset them
+
+        """
+        if not self.enabled:
+            return
+        result = self.summary()
+        if not result['timers'] and not result['counters']:
+            return
+        extra_info = '' if episode is None else ' in episode {}'.format(episode)
+        for name, timer_summary in sorted(result['timers'].items(), key=lambda item: -item[1]['total']):
+            logging.info('Timing of %s%s: %s %d calls, total %.2f s, p50 %.3f ms, p90 %.3f ms, p99 %.3f ms, '
+                         'max %.3f ms', phase.upper(), extra_info, name, timer_summary['count'],
+                         timer_summary['total'], timer_summary['p50'], timer_summary['p90'], timer_summary['p99'],
+                         timer_summary['max'])
+        for name, value in sorted(result['counters'].items()):
+            logging.info('Counter of %s%s: %s %d', phase.upper(), extra_info, name, value)
+        if metrics_dir is not None:
+            result.update({'wall_time': time.time(), 'phase': phase, 'episode': episode})
+            with open(os.path.join(metrics_dir, 'timings.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result) + '\n')
+        self.durations.clear()
+        self.counters.clear()
+
+
+# timings of the process, the functions of this module are the methods of this instance
+TIMINGS = Timings()
+enable = TIMINGS.enable
+timer = TIMINGS.timer
+count = TIMINGS.count
+summary = TIMINGS.summary
+report = TIMINGS.report